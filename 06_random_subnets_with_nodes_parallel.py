@@ -1,11 +1,57 @@
 #!/usr/bin/env python
 
-import os, random
-from multiprocessing import cpu_count, Pool
+from __future__ import print_function
+
+import argparse, cProfile, gzip, hashlib, heapq, io, json, mmap, os, random, resource, sys, tempfile, time
+from multiprocessing import cpu_count, Pool, Process, Queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 total_loops = 100000
 step = 5000
 subnets = [23, 24, 25, 26, 27, 28, 29]
+# subnets drawn and bounded per vectorized round of the numpy engine
+batch_size = 4096
+# subnets carry their range as typed numbers (low network, high broadcast
+# address), ip_num is a long, so 07_neo4j-indexes.py can index them for
+# range predicates
+headers = {
+    'subnets': 'subnetID:ID,low:long,high:long,mask:int\n',
+    'relationships': ':START_ID,:END_ID,:TYPE\n',
+    'ipaddresses': 'ip_addr:ID,ip_num:long\n',
+}
+# --id-type integer: ip_num is the ip node id, subnets are numbered
+# network << 6 | mask, both in their own id group. relationships carry no
+# type column, the import script passes it as --relationships:INCLUDES
+integer_headers = {
+    'subnets': 'subnetID,subnet_num:ID(Subnet),low:long,high:long,mask:int\n',
+    'relationships': ':START_ID(Subnet),:END_ID(IpAddress)\n',
+    'ipaddresses': 'ip_addr,ip_num:ID(IpAddress)\n',
+}
+id_headers = {'string': headers, 'integer': integer_headers}
+# --compress gzip: shard and merged files are name.csv.gz, written at
+# compress_level through compress_buffer bytes of buffer (python3 only).
+# readers pick the codec by file name, so merges read either kind. the codec
+# travels as the compress argument of workers, writers and merges, so spawned
+# processes see it too
+compress_level = 1
+compress_buffer = 1 << 20
+
+
+def csv_name(name, compress=None):
+    return name + '.csv' + ('.gz' if compress == 'gzip' else '')
+
+
+def open_text(filename, mode):
+    if not filename.endswith('.gz'):
+        return open(filename, mode)
+    if mode == 'r':
+        return io.TextIOWrapper(gzip.GzipFile(filename, 'rb'))
+    return io.TextIOWrapper(io.BufferedWriter(
+        gzip.GzipFile(filename, mode + 'b', compress_level), compress_buffer))
 
 def format_binary(num):
     return format(num, '08b')
@@ -13,32 +59,66 @@ def format_binary(num):
 
 def int2ip(i):
     d = i % 256
-    i = i / 256
+    i = i // 256
     c = i % 256
-    i = i / 256
+    i = i // 256
     b = i % 256
-    a = i / 256
+    a = i // 256
     return "%s.%s.%s.%s" % (a, b, c, d)
 
 
-def generate_subnets(loop, *argv):
+def open_shard_files(loop, id_type='string', compress=None):
+    fsub = open_text(csv_name('subnets-' + str(loop), compress), "a")
+    fsub.write(id_headers[id_type]['subnets'])
+    frel = open_text(csv_name('relationships-' + str(loop), compress), "a")
+    frel.write(id_headers[id_type]['relationships'])
+    fip = open_text(csv_name('ipaddresses-' + str(loop), compress), "a")
+    fip.write(id_headers[id_type]['ipaddresses'])
+    return fsub, frel, fip
+
+
+def subnet_row(network_str, mask, low_ip, high_ip, id_type='string'):
+    # subnets.csv row and relationship row prefix of one subnet. integer ids
+    # are per network, so the subnetID is the network address, not the host
+    bounds = ',%d,%d,%d\n' % (low_ip, high_ip, mask)
+    if id_type == 'integer':
+        subnet_num = str(low_ip << 6 | mask)
+        return int2ip(low_ip) + '/' + str(mask) + ',' + subnet_num + bounds, subnet_num + ','
+    return network_str + bounds, '"' + network_str + '","'
+
+
+def task_seed(seed, loop):
+    # 64 bit seed of the task generating loop subnets, derived from the
+    # master seed so every task draws its own independent stream
+    digest = hashlib.sha256(('%d/%d' % (seed, loop)).encode('ascii')).hexdigest()
+    return int(digest[:16], 16)
+
+
+def task_loops(total_loops, step, shard=None):
+    # loop numbers of the tasks, shard (i, n) keeps every n-th task from i
+    loops = list(range(total_loops, 0, -step))
+    if shard is not None:
+        loops = loops[shard[0]::shard[1]]
+    return loops
+
+
+def generate_subnets(loop, id_type='string', seed=None, compress=None):
 
-    fsub = open('subnets-' + str(loop) + ".csv", "a")
-    fsub.write('subnetID:ID\n')
-    frel = open('relationships-' + str(loop) + ".csv", "a")    
-    frel.write(":START_ID,:END_ID,:TYPE\n")
-    fip = open('ipaddresses-' + str(loop) + ".csv", "a")
-    fip.write('ip_addr:ID,ip_num\n')
+    fsub, frel, fip = open_shard_files(loop, id_type, compress)
+    # without a master seed the stream is seeded from the os, forked workers
+    # would otherwise all continue the same inherited random state
+    rng = random.Random(task_seed(seed, loop) if seed is not None else None)
     ip_list = []
+    hosts = 0
 
     while loop > 0 :
         loop -= 1
 
-        a = random.randint(1,254)
-        b = random.randint(1,254)
-        c = random.randint(1,254)
-        d = random.randint(1,254)
-        mask = subnets[random.randint(0,len(subnets)-1)]
+        a = rng.randint(1,254)
+        b = rng.randint(1,254)
+        c = rng.randint(1,254)
+        d = rng.randint(1,254)
+        mask = subnets[rng.randint(0,len(subnets)-1)]
 
         ip_int = int(format_binary(a) + format_binary(b) + format_binary(c) + format_binary(d), 2)
         wildcard = 32 - mask
@@ -46,51 +126,581 @@ def generate_subnets(loop, *argv):
         broadcast_mask = int('0' * mask + '1' * wildcard, 2)
         low_ip = ip_int & network_mask
         high_ip = ip_int | broadcast_mask
-    
+
         ip = "%s.%s.%s.%s" % (a, b, c, d)
         network_str = ip + "/" + str(mask)
-        fsub.write(network_str + '\n')
-    
+        sub_row, rel_head = subnet_row(network_str, mask, low_ip, high_ip, id_type)
+        fsub.write(sub_row)
+        hosts += high_ip - low_ip
+
         for i in range(low_ip, high_ip):
             my_ip = int2ip(i)
-            frel.write('"' + network_str + '","' + my_ip + '",' + 'INCLUDES\n')
+            if id_type == 'integer':
+                frel.write(rel_head + str(i) + '\n')
+            else:
+                frel.write('"' + network_str + '","' + my_ip + '",' + 'INCLUDES\n')
             #if i not in ip_list:
             fip.write(my_ip + "," + str(i) + "\n")
             #    ip_list.append(i)
-    
+
     fsub.close()
     frel.close()
     fip.close()
+    return hosts
+
+
+# string tables for the batched engine, indexed by the last octet
+octets = [str(i) for i in range(256)]
+rel_tails = [o + '",INCLUDES\n' for o in octets]
+ip_tails = [o + ',' for o in octets]
+
+
+def block_prefix(block):
+    # "a.b.c." of the /24 block number block (ip >> 8)
+    return "%s.%s.%s." % (block >> 16, (block >> 8) & 255, block & 255)
+
+
+def format_hosts(rel_head, low_ip, high_ip, rel_rows, ip_rows, id_type='string'):
+    # rows for hosts [low_ip, high_ip) are produced one /24 block at a time:
+    # the block prefix is shared, so a block is a single join over the tables
+    if id_type == 'integer':
+        rel_rows.append((rel_head + '%d\n') * (high_ip - low_ip) % tuple(range(low_ip, high_ip)))
+    while low_ip < high_ip:
+        block = low_ip >> 8
+        end = min(high_ip, (block + 1) << 8)
+        lo, hi = low_ip & 255, end - (block << 8)
+        prefix = block_prefix(block)
+
+        if id_type != 'integer':
+            head = rel_head + prefix
+            rel_rows.append(head + head.join(rel_tails[lo:hi]))
+        template = prefix + ('%d\n' + prefix).join(ip_tails[lo:hi]) + '%d\n'
+        ip_rows.append(template % tuple(range(low_ip, end)))
+        low_ip = end
+
+
+def subnet_batches(loop, seed=None):
+    # yields lists of (network_str, mask, low_ip, high_ip) for loop subnets,
+    # batch_size subnets are drawn and their network/broadcast bounds computed
+    # at once with array bit ops
+    if seed is not None:
+        seed = task_seed(seed, loop)
+        seed = [seed & 0xffffffff, seed >> 32]
+    rng = np.random.RandomState(seed)
+    masks = np.array(subnets, dtype=np.uint64)
+
+    while loop > 0:
+        n = min(loop, batch_size)
+        loop -= n
+
+        octet = rng.randint(1, 255, size=(4, n)).astype(np.uint64)
+        mask = masks[rng.randint(0, len(subnets), size=n)]
+
+        ip_int = (octet[0] << 24) | (octet[1] << 16) | (octet[2] << 8) | octet[3]
+        broadcast_mask = (np.uint64(1) << (np.uint64(32) - mask)) - np.uint64(1)
+        low_ip = ip_int & ~broadcast_mask
+        high_ip = ip_int | broadcast_mask
+
+        yield [("%s.%s.%s.%s/%s" % (a, b, c, d, m), m, low, high)
+               for a, b, c, d, m, low, high in zip(*(octet.tolist() + [
+                   mask.tolist(), low_ip.tolist(), high_ip.tolist()]))]
+
+
+def generate_subnets_numpy(loop, id_type='string', seed=None, compress=None):
+    # same output as generate_subnets, drawn and formatted in batches
+    fsub, frel, fip = open_shard_files(loop, id_type, compress)
+    hosts = 0
+
+    for batch in subnet_batches(loop, seed):
+        sub_rows, rel_rows, ip_rows = [], [], []
+        for network_str, mask, low, high in batch:
+            sub_row, rel_head = subnet_row(network_str, mask, low, high, id_type)
+            sub_rows.append(sub_row)
+            hosts += high - low
+            format_hosts(rel_head, low, high, rel_rows, ip_rows, id_type)
+
+        fsub.writelines(sub_rows)
+        frel.writelines(rel_rows)
+        fip.writelines(ip_rows)
+
+    fsub.close()
+    frel.close()
+    fip.close()
+    return hosts
+
+
+# queues of the pipeline writers, set in every pool worker by init_pipeline
+pipeline_queues = None
+
+
+def init_pipeline(queues):
+    global pipeline_queues
+    pipeline_queues = queues
+
+
+def generate_subnets_pipeline(loop, id_type='string', seed=None, compress=None):
+    # formats rows like generate_subnets_numpy, but hands every batch to the
+    # writer processes instead of a shard file. put() blocks while a queue is
+    # full, so workers can not run ahead of the disk. compress is that of
+    # the writers
+    hosts = 0
+    for batch in subnet_batches(loop, seed):
+        sub_rows, rel_rows, ip_rows = [], [], []
+        for network_str, mask, low, high in batch:
+            sub_row, rel_head = subnet_row(network_str, mask, low, high, id_type)
+            hosts += high - low
+            rel, ips = [], []
+            format_hosts(rel_head, low, high, rel, ips, id_type)
+            sub_rows.append(sub_row)
+            rel_rows.append((sub_row, ''.join(rel)))
+            ip_rows.append((low, high, ''.join(ips)))
+
+        pipeline_queues['subnets'].put(sub_rows)
+        pipeline_queues['relationships'].put(rel_rows)
+        pipeline_queues['ipaddresses'].put(ip_rows)
+    return hosts
+
+
+def pipeline_writer(master, queue, bitmap_file=None, id_type='string',
+                    compress=None):
+    # single writer of master.csv, dedups while writing: subnets by line,
+    # relationships by subnet, ip addresses in an IpBitmap
+    f = open_text(csv_name(master, compress), "a")
+    f.write(id_headers[id_type][master])
+    seen = IpBitmap(bitmap_file) if master == 'ipaddresses' else set()
+
+    for batch in iter(queue.get, None):
+        if master == 'subnets':
+            for line in batch:
+                if line not in seen:
+                    seen.add(line)
+                    f.write(line)
+        elif master == 'relationships':
+            for sub_row, rows in batch:
+                if sub_row not in seen:
+                    seen.add(sub_row)
+                    f.write(rows)
+        else:
+            for low, high, rows in batch:
+                fresh = [num for num in range(low, high) if num not in seen]
+                if len(fresh) == high - low:
+                    f.write(rows)
+                elif fresh:
+                    lines = rows.splitlines(True)
+                    f.write(''.join([lines[num - low] for num in fresh]))
+                for num in fresh:
+                    seen.add(num)
+
+    f.close()
+    if master == 'ipaddresses':
+        seen.close()
+
+
+def run_pipeline(opts, processes):
+    queues = dict((master, Queue(maxsize=opts.queue_size)) for master in headers)
+    writers = [Process(target=pipeline_writer,
+                       args=(master, queues[master], opts.bitmap_file,
+                             opts.id_type, opts.compress))
+               for master in headers]
+    for writer in writers:
+        writer.start()
+
+    pool = Pool(processes=processes, initializer=init_pipeline, initargs=(queues,))
+    print_plan(opts, processes)
+    tasks = run_tasks(pool, generate_subnets_pipeline, opts)
 
+    for master in headers:
+        queues[master].put(None)
+    for writer in writers:
+        writer.join()
+    return tasks
 
-pool = Pool(processes=cpu_count()-1) or 1
-print pool
 
-loops = total_loops
-while loops > 0:
-    pool.apply_async(generate_subnets, args=(loops, None))
-    loops -= step
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss
 
-pool.close()
-pool.join()
 
-#merge files, keep uniq lines
-print "merging files for uniq lines...",
-for master in ['ipaddresses', 'subnets', 'relationships']:
-    print "\t" + master + "...",
-    loops = total_loops
-    f = open(master + '.csv', "a")
+def run_task(worker, loop, id_type='string', profile_dir=None, seed=None,
+             compress=None):
+    # instrumented worker call, returns the counters of the task. its shard
+    # files (none in pipeline mode) are the bytes written
+    start = time.time()
+    if profile_dir:
+        profile = cProfile.Profile()
+        hosts = profile.runcall(worker, loop, id_type, seed, compress)
+        profile.dump_stats(os.path.join(profile_dir, 'worker-%d-%d.prof' % (os.getpid(), loop)))
+    else:
+        hosts = worker(loop, id_type, seed, compress)
+    shards = [csv_name(master + '-' + str(loop), compress) for master in headers]
+    return {'task': loop, 'pid': os.getpid(), 'subnets': loop, 'hosts': hosts,
+            'bytes': sum(os.path.getsize(f) for f in shards if os.path.exists(f)),
+            'seconds': time.time() - start, 'peak_rss_kb': peak_rss_kb()}
+
+
+def print_plan(opts, processes):
+    # every task generates as many subnets as its loop number
+    loops = task_loops(opts.total_loops, opts.step, opts.shard)
+    print("generating %d subnets in %d tasks on %d processes, %s engine%s, seed %d%s" %
+          (sum(loops), len(loops), processes, opts.engine,
+           ", pipeline" if opts.pipeline else "", opts.seed,
+           ", shard %d/%d" % opts.shard if opts.shard else ""))
+
+
+def print_progress(tasks, total, started):
+    elapsed = time.time() - started
+    hosts = sum(task['hosts'] for task in tasks)
+    print("progress: %d/%d tasks, %d subnets, %d hosts, %.0f hosts/s, %.0fs" %
+          (len(tasks), total, sum(task['subnets'] for task in tasks), hosts,
+           hosts / elapsed if elapsed else 0, elapsed))
+    sys.stdout.flush()
+
+
+def run_tasks(pool, worker, opts):
+    # submits one task per step of total_loops and waits for them. with
+    # --stats, --progress or --profile-dir tasks run through run_task and
+    # their counters are returned, progress is printed every --progress seconds
+    instrumented = opts.stats or opts.progress or opts.profile_dir
+    tasks, results = [], []
+    for loops in task_loops(opts.total_loops, opts.step, opts.shard):
+        if instrumented:
+            results.append(pool.apply_async(run_task, args=(worker, loops, opts.id_type,
+                                                            opts.profile_dir, opts.seed,
+                                                            opts.compress),
+                                            callback=tasks.append))
+        else:
+            pool.apply_async(worker, args=(loops, opts.id_type, opts.seed, opts.compress))
+    pool.close()
+
+    started = last = time.time()
+    pending = results if opts.progress else []
+    while pending:
+        pending[0].wait(opts.progress)
+        pending = [result for result in pending if not result.ready()]
+        if time.time() - last >= opts.progress:
+            last = time.time()
+            print_progress(tasks, len(results), started)
+
+    pool.join()
+    return tasks
+
+
+def write_report(path, opts, phases, tasks):
+    # json report: options, phase timings, task counters, totals and peak rss
+    seconds = phases['generate']
+    hosts = sum(task['hosts'] for task in tasks)
+    outputs = [csv_name(master, opts.compress) for master in headers]
+    report = {
+        'options': vars(opts),
+        'phases': phases,
+        'workers': sorted(tasks, key=lambda task: -task['task']),
+        'totals': {
+            'tasks': len(tasks),
+            'subnets': sum(task['subnets'] for task in tasks),
+            'hosts': hosts,
+            'hosts_per_sec': hosts / seconds if seconds else 0,
+            'shard_bytes': sum(task['bytes'] for task in tasks),
+            'bytes': sum(os.path.getsize(f) for f in outputs if os.path.exists(f)),
+        },
+        'peak_rss_kb': {'main': peak_rss_kb(),
+                        'children': peak_rss_kb(resource.RUSAGE_CHILDREN)},
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+engines = {
+    'python': generate_subnets,
+    'numpy': generate_subnets_numpy,
+}
+
+
+# set bit positions of every byte value, lowest bit first
+bit_positions = [[i for i in range(8) if byte >> i & 1] for byte in range(256)]
+
+
+class IpBitmap(object):
+    # one bit per ipv4 address: 2^32 bits, 512 MB whatever the input size.
+    # kept in memory, or in a memory-mapped scratch file when path is given
+
+    size = 1 << 29
+    scan_chunk = 1 << 20
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.bits = bytearray(self.size)
+        else:
+            self.file = open(path, 'w+b')
+            self.file.truncate(self.size)
+            self.bits = mmap.mmap(self.file.fileno(), self.size)
+
+    def add(self, num):
+        self.bits[num >> 3] |= 1 << (num & 7)
+
+    def __contains__(self, num):
+        return bool(self.bits[num >> 3] >> (num & 7) & 1)
+
+    def blocks(self):
+        # yields (block, last octets) in ascending order for every /24 block
+        # with at least one address set, empty regions are skipped in bulk
+        empty_chunk = b'\0' * self.scan_chunk
+        empty_block = b'\0' * 32
+        for offset in range(0, self.size, self.scan_chunk):
+            chunk = self.bits[offset:offset + self.scan_chunk]
+            if chunk == empty_chunk:
+                continue
+            chunk = bytearray(chunk)
+            for i in range(0, self.scan_chunk, 32):
+                if chunk[i:i + 32] == empty_block:
+                    continue
+                hosts = []
+                for j in range(32):
+                    if chunk[i + j]:
+                        hosts.extend([j * 8 + bit for bit in bit_positions[chunk[i + j]]])
+                yield (offset + i) // 32, hosts
+
+    def close(self):
+        if self.path is not None:
+            self.bits.close()
+            self.file.close()
+            os.unlink(self.path)
+
+
+def shard_names(master, total_loops, step, shard=None, compress=None):
+    for loops in task_loops(total_loops, step, shard):
+        yield csv_name(master + '-' + str(loops), compress)
+
+
+def merge_lines(master, filenames, compress=None):
+    f = open_text(csv_name(master, compress), "a")
     lines_seen = set()
-    while loops > 0:
-        filename = master + '-' + str(loops) + ".csv"
+    for filename in filenames:
         try:
-            for line in open(filename, "r"):
+            for line in open_text(filename, "r"):
                 if line not in lines_seen:
                     f.write(line)
-                    lines_seen.add(line) 
+                    lines_seen.add(line)
             os.unlink(filename)
         except:
             pass
-        loops -= step
     f.close()
-print "done"
+
+
+def merge_ips_bitmap(master, filenames, bitmap_file=None, id_type='string',
+                     compress=None):
+    # ip_num of every row marks the bitmap, no line is hashed or kept. the
+    # merged file is then written in ascending ip_num order from the bitmap
+    bitmap = IpBitmap(bitmap_file)
+    for filename in filenames:
+        try:
+            shard = open_text(filename, "r")
+        except IOError:
+            continue
+        shard.readline()
+        for line in shard:
+            bitmap.add(int(line[line.rindex(',') + 1:]))
+        shard.close()
+        os.unlink(filename)
+
+    f = open_text(csv_name(master, compress), "a")
+    f.write(id_headers[id_type][master])
+    for block, hosts in bitmap.blocks():
+        prefix = block_prefix(block)
+        base = block << 8
+        f.write(''.join([prefix + ip_tails[h] + str(base + h) + '\n' for h in hosts]))
+    f.close()
+    bitmap.close()
+
+
+# rough python cost of holding one line in a run (str object + list slot)
+line_overhead = 64
+# most runs merged in one pass, more runs are first merged in groups
+max_runs = 128
+
+
+def spill_run(lines, tmp_dir):
+    lines.sort()
+    run = tempfile.NamedTemporaryFile(mode='w', prefix='run-', suffix='.csv',
+                                      dir=tmp_dir, delete=False)
+    last = None
+    for line in lines:
+        if line != last:
+            run.write(line)
+            last = line
+    run.close()
+    return run.name
+
+
+def merge_runs(runs, out):
+    # k-way merge of sorted runs, duplicates end up adjacent and are dropped
+    files = [open(run, "r") for run in runs]
+    last = None
+    for line in heapq.merge(*files):
+        if line != last:
+            out.write(line)
+            last = line
+    for f in files:
+        f.close()
+    for run in runs:
+        os.unlink(run)
+
+
+def merge_external(master, filenames, memory_budget, tmp_dir=None,
+                   id_type='string', compress=None):
+    # external sort: shards are cut into sorted runs of at most memory_budget
+    # bytes, spilled to tmp_dir and merged, so memory use does not grow
+    # with the data. the merged file comes out sorted and deduplicated
+    runs = []
+    lines, size = [], 0
+    for filename in filenames:
+        try:
+            shard = open_text(filename, "r")
+        except IOError:
+            continue
+        shard.readline()
+        for line in shard:
+            lines.append(line)
+            size += len(line) + line_overhead
+            if size >= memory_budget:
+                runs.append(spill_run(lines, tmp_dir))
+                lines, size = [], 0
+        shard.close()
+        os.unlink(filename)
+    if lines:
+        runs.append(spill_run(lines, tmp_dir))
+    del lines
+
+    while len(runs) > max_runs:
+        merged = []
+        for i in range(0, len(runs), max_runs):
+            run = tempfile.NamedTemporaryFile(mode='w', prefix='run-', suffix='.csv',
+                                              dir=tmp_dir, delete=False)
+            merge_runs(runs[i:i + max_runs], run)
+            run.close()
+            merged.append(run.name)
+        runs = merged
+
+    f = open_text(csv_name(master, compress), "a")
+    f.write(id_headers[id_type][master])
+    merge_runs(runs, f)
+    f.close()
+
+
+def merge_shards(total_loops, step, dedup='lines', bitmap_file=None,
+                 memory_budget=256 << 20, tmp_dir=None, id_type='string',
+                 timings=None, shard=None, compress=None):
+    #merge files, keep uniq lines, seconds per file go into timings
+    print("merging files for uniq lines...", end=' ')
+    for master in ['ipaddresses', 'subnets', 'relationships']:
+        print("\t" + master + "...", end=' ')
+        start = time.time()
+        filenames = shard_names(master, total_loops, step, shard, compress)
+        if master == 'ipaddresses' and dedup == 'bitmap':
+            merge_ips_bitmap(master, filenames, bitmap_file, id_type, compress)
+        elif dedup != 'lines':
+            merge_external(master, filenames, memory_budget, tmp_dir, id_type,
+                           compress)
+        else:
+            merge_lines(master, filenames, compress)
+        if timings is not None:
+            timings[master] = time.time() - start
+    print("done")
+
+
+def parse_shard(value):
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, got %r' % value)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError('shard I/N needs 0 <= I < N, got %r' % value)
+    return index, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate random subnets '
+                                     'with their ip addresses for neo4j import')
+    parser.add_argument('--engine', choices=sorted(engines),
+                        default='numpy' if np is not None else 'python',
+                        help='numpy expands hosts in batches (default when '
+                        'numpy is installed), python is one host at a time')
+    parser.add_argument('--total-loops', type=int, default=total_loops)
+    parser.add_argument('--step', type=int, default=step)
+    parser.add_argument('--dedup', choices=['lines', 'bitmap', 'external'],
+                        default='lines',
+                        help='lines keeps every unique line in a set, bitmap '
+                        'dedups ip addresses in a 512 MB bitmap and writes '
+                        'them sorted by ip_num (other files as external), '
+                        'external sorts in bounded memory and merges runs')
+    parser.add_argument('--bitmap-file', metavar='PATH',
+                        help='memory-map the bitmap to this scratch file '
+                        'instead of holding it in memory (python3 only)')
+    parser.add_argument('--id-type', choices=sorted(id_headers), default='string',
+                        help='integer uses ip_num and a packed network/mask '
+                        'number as node ids, import with --id-type=INTEGER')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='workers stream row batches to one writer process '
+                        'per output file, no shard files and no merge pass '
+                        '(numpy engine, ip addresses dedup in a bitmap)')
+    parser.add_argument('--queue-size', type=int, default=8, metavar='BATCHES',
+                        help='batches buffered per writer in pipeline mode')
+    parser.add_argument('--memory-budget', type=int, default=256, metavar='MB',
+                        help='memory for one sorted run of the external merge')
+    parser.add_argument('--tmp-dir', metavar='PATH',
+                        help='directory for the sorted runs of the external merge')
+    parser.add_argument('--seed', type=int,
+                        help='master seed, every task draws from its own stream '
+                        'derived from it. the same seed, loops and step give '
+                        'the same files (default: random, printed)')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help='run only tasks I, I+N, I+2N.. (I from 0 to N-1), '
+                        'N machines with the same seed generate disjoint sets '
+                        'of tasks of one dataset')
+    parser.add_argument('--compress', choices=['gzip'],
+                        help='write shard and merged files gzip compressed '
+                        '(.csv.gz, python3 only), 07_neo4j-import.sh imports '
+                        'them as they are')
+    parser.add_argument('--stats', metavar='PATH',
+                        help='write phase timings, per task counters and peak '
+                        'rss as json to this file')
+    parser.add_argument('--progress', type=float, default=0, metavar='SECONDS',
+                        help='print finished tasks, hosts and hosts/s this often')
+    parser.add_argument('--profile-dir', metavar='PATH',
+                        help='dump cProfile stats of every task into this directory')
+    opts = parser.parse_args()
+
+    if opts.seed is None:
+        opts.seed = random.SystemRandom().getrandbits(63)
+    if opts.bitmap_file and sys.version_info[0] < 3:
+        parser.error('--bitmap-file requires python3')
+    if opts.compress and sys.version_info[0] < 3:
+        parser.error('--compress requires python3')
+
+    if (opts.engine == 'numpy' or opts.pipeline) and np is None:
+        parser.error('numpy engine requires numpy')
+    worker = engines[opts.engine]
+    processes = max(cpu_count() - 1, 1)
+
+    phases = {}
+    started = time.time()
+    if opts.pipeline:
+        tasks = run_pipeline(opts, processes)
+        phases['generate'] = time.time() - started
+    else:
+        pool = Pool(processes=processes)
+        print_plan(opts, processes)
+        tasks = run_tasks(pool, worker, opts)
+        phases['generate'] = time.time() - started
+
+        started = time.time()
+        phases['merge'] = {}
+        merge_shards(opts.total_loops, opts.step, opts.dedup, opts.bitmap_file,
+                     opts.memory_budget << 20, opts.tmp_dir, opts.id_type,
+                     phases['merge'], opts.shard, opts.compress)
+        phases['merge']['total'] = time.time() - started
+
+    if opts.stats:
+        write_report(opts.stats, opts, phases, tasks)
+
+if __name__ == "__main__":
+    main()
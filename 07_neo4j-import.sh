@@ -1,3 +1,31 @@
 #!/bin/bash
 
-neo4j-admin import --database=subnets.db --nodes subnets.csv --nodes ipaddresses.csv --relationships relationships.csv
+# usage: sh 07_neo4j-import.sh [string|integer]
+# pass the same id type the files were generated with (--id-type)
+ID_TYPE=${1:-string}
+
+# files generated with --compress gzip are imported as they are
+EXT=csv
+if [ -f subnets.csv.gz ]; then
+    EXT=csv.gz
+fi
+
+# CONTAINS/OVERLAPS between subnets from 09_subnet_overlaps.py, when present
+OVERLAPS=
+for f in overlaps.csv.gz overlaps.csv; do
+    if [ -f $f ]; then
+        OVERLAPS="--relationships $f"
+        break
+    fi
+done
+
+if [ "$ID_TYPE" = "integer" ]; then
+    neo4j-admin import --database=subnets.db --id-type=INTEGER --nodes:Subnet subnets.$EXT --nodes:IpAddress ipaddresses.$EXT --relationships:INCLUDES relationships.$EXT $OVERLAPS
+else
+    neo4j-admin import --database=subnets.db --nodes:Subnet subnets.$EXT --nodes:IpAddress ipaddresses.$EXT --relationships relationships.$EXT $OVERLAPS
+fi
+
+# constraints and range indexes (low/high/mask, ip_num) from the file headers,
+# apply once the database is started
+python3 07_neo4j-indexes.py --output indexes.cypher && \
+    echo "indexes: cypher-shell < indexes.cypher"
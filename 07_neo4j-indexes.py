@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+07_neo4j-indexes.py writes the index and constraint statements for the
+graph imported by 07_neo4j-import.sh, from the headers of the generated
+files:
+
+    python3 07_neo4j-indexes.py > indexes.cypher
+    cypher-shell < indexes.cypher
+
+The id column of every node file gets a unique constraint (which is also an
+index), typed number columns (:long, :int) get an index, so containment
+questions are indexed range predicates instead of label scans:
+
+    MATCH (s:Subnet) WHERE s.low <= 3232284104 AND s.high >= 3232284104 RETURN s
+    MATCH (ip:IpAddress) WHERE ip.ip_num >= 3232284096 AND ip.ip_num < 3232284352 RETURN ip
+
+--syntax 3 is neo4j 3.x (as in README.md), --syntax 5 the current syntax.
+"""
+
+import argparse, gzip, os, sys
+
+# node file of every label, as imported by 07_neo4j-import.sh
+node_files = [('Subnet', 'subnets'), ('IpAddress', 'ipaddresses')]
+indexed_types = ['long', 'int', 'short', 'byte', 'float', 'double']
+
+
+def read_header(name):
+    # header line of name.csv or name.csv.gz
+    for filename in (name + '.csv.gz', name + '.csv'):
+        if os.path.exists(filename):
+            f = gzip.open(filename, 'rt') if filename.endswith('.gz') else open(filename)
+            header = f.readline().rstrip('\n')
+            f.close()
+            return header
+    raise IOError('no %s.csv or %s.csv.gz' % (name, name))
+
+
+def header_properties(header):
+    # (id properties, indexed properties) of a node header. an id column
+    # without a name (":ID") is not stored as a property
+    ids, indexed = [], []
+    for column in header.split(','):
+        name, _, kind = column.partition(':')
+        if not name:
+            continue
+        if kind.startswith('ID'):
+            ids.append(name)
+        elif kind in indexed_types:
+            indexed.append(name)
+    return ids, indexed
+
+
+def statements(label, header, syntax='3'):
+    ids, indexed = header_properties(header)
+    var = label[0].lower()
+    for name in ids:
+        if syntax == '3':
+            yield 'CREATE CONSTRAINT ON (%s:%s) ASSERT %s.%s IS UNIQUE;' % (var, label, var, name)
+        else:
+            yield 'CREATE CONSTRAINT %s_%s IF NOT EXISTS FOR (%s:%s) REQUIRE %s.%s IS UNIQUE;' % (
+                label.lower(), name.lower(), var, label, var, name)
+    for name in indexed:
+        if syntax == '3':
+            yield 'CREATE INDEX ON :%s(%s);' % (label, name)
+        else:
+            yield 'CREATE INDEX %s_%s IF NOT EXISTS FOR (%s:%s) ON (%s.%s);' % (
+                label.lower(), name.lower(), var, label, var, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index and constraint statements '
+                                     'for the imported subnets graph')
+    parser.add_argument('--syntax', choices=['3', '5'], default='3',
+                        help='neo4j cypher syntax version')
+    parser.add_argument('--output', help='statement file (default stdout)')
+    opts = parser.parse_args()
+
+    lines = []
+    for label, name in node_files:
+        lines.extend(statements(label, read_header(name), opts.syntax))
+    if opts.syntax == '3':
+        lines.append('CALL db.awaitIndexes();')
+    else:
+        lines.append('CALL db.awaitIndexes(3600);')
+
+    out = open(opts.output, 'w') if opts.output else sys.stdout
+    out.write('\n'.join(lines) + '\n')
+    if opts.output:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+08_subnet_index.py answers "which subnets contain this ip" from subnets.csv
+(06 output) without the graph.
+
+build reads the subnet ids, turns every a.b.c.d/mask into its [network,
+broadcast] range and saves the ranges sorted by start, with the running
+maximum of their ends, into one file:
+
+    python3 08_subnet_index.py build --subnets subnets.csv --index subnets.idx
+
+query memory-maps that file (nothing is parsed on load) and looks up ips,
+prefixes (a.b.c.d/mask) or wildcards (17.95.147.*), given as arguments or one
+per line in --file. A subnet matches a query when their ranges overlap, with
+--contain only when it holds the whole query range:
+
+    python3 08_subnet_index.py query 17.95.147.* 192.168.189.200
+
+Lookups are two binary searches per query: the window of candidates starts
+at the first subnet whose running max end reaches the query and ends at the
+last subnet starting before the query ends, the candidates are then checked
+one by one. With numpy a batch is searched and filtered as whole arrays.
+"""
+
+import argparse, gzip, mmap, struct, sys, time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from subnet_cidr import cidr_range, ip2int
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+magic = b'SUBNIDX1'
+# magic, subnets, bytes of the id blob
+header = struct.Struct('<8sQQ')
+
+
+def open_text(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def parse_query(query):
+    # (low, high) of an ip, a prefix or a wildcard like 17.95.147.*
+    query = query.strip()
+    if '*' in query:
+        octets = [octet for octet in query.split('.') if octet != '*']
+        return cidr_range('.'.join(octets + ['0'] * (4 - len(octets))) +
+                          '/' + str(8 * len(octets)))
+    if '/' in query:
+        return cidr_range(query)
+    num = ip2int(query)
+    return num, num
+
+
+def read_subnets(filename):
+    # subnet id (first column) of every row of subnets.csv, both id types
+    f = open_text(filename)
+    f.readline()
+    for line in f:
+        subnet = line.split(',', 1)[0].strip()
+        if subnet:
+            yield subnet
+    f.close()
+
+
+def build_index(subnets_csv, index_file):
+    subnets = list(read_subnets(subnets_csv))
+    ranges = [cidr_range(subnet) for subnet in subnets]
+    order = sorted(range(len(ranges)), key=ranges.__getitem__)
+
+    starts = array('I', [ranges[i][0] for i in order])
+    ends = array('I', [ranges[i][1] for i in order])
+    max_ends = array('I', ends)
+    for i in range(1, len(max_ends)):
+        if max_ends[i] < max_ends[i - 1]:
+            max_ends[i] = max_ends[i - 1]
+
+    ids = [subnets[i].encode('ascii') for i in order]
+    offsets = array('Q', [0])
+    for subnet in ids:
+        offsets.append(offsets[-1] + len(subnet))
+    blob = b''.join(ids)
+
+    f = open(index_file, 'wb')
+    f.write(header.pack(magic, len(ids), len(blob)))
+    for values in (starts, ends, max_ends, offsets):
+        values.tofile(f)
+    f.write(blob)
+    f.close()
+    return len(ids)
+
+
+class SubnetIndex(object):
+    # read-only view of an index file, arrays are memoryviews of the mapping
+    # (numpy arrays on top of them when numpy is installed)
+
+    def __init__(self, index_file):
+        self.file = open(index_file, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        found, self.size, blob_size = header.unpack_from(self.map)
+        if found != magic:
+            raise ValueError('%s is not a subnet index' % index_file)
+
+        view = memoryview(self.map)
+        offset = header.size
+        arrays = []
+        for code, count in (('I', self.size), ('I', self.size), ('I', self.size),
+                            ('Q', self.size + 1)):
+            length = count * struct.calcsize(code)
+            arrays.append(view[offset:offset + length].cast(code))
+            offset += length
+        self.starts, self.ends, self.max_ends, self.offsets = arrays
+        self.blob = view[offset:offset + blob_size]
+
+    def subnet(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('ascii')
+
+    def window(self, low, high, contain=False):
+        # candidate positions [first, last) for one query range
+        if contain:
+            return bisect_left(self.max_ends, high), bisect_right(self.starts, low)
+        return bisect_left(self.max_ends, low), bisect_right(self.starts, high)
+
+    def lookup(self, lows, highs, contain=False):
+        # (query, position) of every match of the query ranges, in query order
+        if np is not None:
+            return self.lookup_numpy(lows, highs, contain)
+        matches = []
+        for query, (low, high) in enumerate(zip(lows, highs)):
+            first, last = self.window(low, high, contain)
+            bound = high if contain else low
+            matches.extend((query, position) for position in range(first, last)
+                           if self.ends[position] >= bound)
+        return matches
+
+    def lookup_numpy(self, lows, highs, contain=False):
+        starts = np.frombuffer(self.starts, dtype=np.uint32)
+        ends = np.frombuffer(self.ends, dtype=np.uint32)
+        max_ends = np.frombuffer(self.max_ends, dtype=np.uint32)
+        lows = np.asarray(lows, dtype=np.uint32)
+        highs = np.asarray(highs, dtype=np.uint32)
+
+        bounds = highs if contain else lows
+        first = np.searchsorted(max_ends, bounds, 'left')
+        last = np.searchsorted(starts, lows if contain else highs, 'right')
+        counts = np.maximum(last.astype(np.int64) - first, 0)
+
+        # every (query, candidate) pair as flat arrays, then filtered at once
+        queries = np.repeat(np.arange(len(lows)), counts)
+        positions = np.repeat(first, counts) + \
+            np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        keep = ends[positions] >= bounds[queries]
+        return list(zip(queries[keep].tolist(), positions[keep].tolist()))
+
+    def close(self):
+        self.starts.release()
+        self.ends.release()
+        self.max_ends.release()
+        self.offsets.release()
+        self.blob.release()
+        self.map.close()
+        self.file.close()
+
+
+def read_queries(opts):
+    queries = list(opts.queries)
+    if opts.file:
+        f = open_text(opts.file)
+        queries.extend(line.strip() for line in f if line.strip())
+        f.close()
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ip to subnet lookups from '
+                                     'subnets.csv without the graph')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='index subnets.csv')
+    build.add_argument('--subnets', default='subnets.csv')
+    build.add_argument('--index', default='subnets.idx')
+    query = commands.add_parser('query', help='subnets of ips, prefixes or '
+                                'wildcards (17.95.147.*)')
+    query.add_argument('queries', nargs='*')
+    query.add_argument('--index', default='subnets.idx')
+    query.add_argument('--file', help='one query per line')
+    query.add_argument('--contain', action='store_true',
+                       help='only subnets holding the whole query range')
+    query.add_argument('--count', action='store_true',
+                       help='print the number of matches only')
+    opts = parser.parse_args()
+
+    if opts.command == 'build':
+        started = time.time()
+        count = build_index(opts.subnets, opts.index)
+        print("indexed %d subnets into %s in %.2fs" % (count, opts.index,
+                                                       time.time() - started),
+              file=sys.stderr)
+    elif opts.command == 'query':
+        queries = read_queries(opts)
+        ranges = [parse_query(query) for query in queries]
+        index = SubnetIndex(opts.index)
+        started = time.time()
+        matches = index.lookup([low for low, _ in ranges], [high for _, high in ranges],
+                               opts.contain)
+        elapsed = time.time() - started
+        if opts.count:
+            print(len(matches))
+        else:
+            for query, position in matches:
+                print("%s\t%s" % (queries[query], index.subnet(position)))
+        print("%d queries, %d matches in %.3fs" % (len(queries), len(matches), elapsed),
+              file=sys.stderr)
+        index.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
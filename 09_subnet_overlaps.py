@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+09_subnet_overlaps.py writes the subnet pairs that share ip addresses as
+relationships between subnets, so "which subnets overlap" is one hop in the
+graph instead of a walk over every ip:
+
+    python3 09_subnet_overlaps.py --subnets subnets.csv --output overlaps.csv
+
+(A)-[:CONTAINS]->(B) when the range of A holds the whole range of B,
+(A)-[:OVERLAPS]->(B) when they share addresses otherwise. Subnets are cidr
+blocks, which nest or are disjoint, so OVERLAPS only links two ids of the
+same range (host addresses a.b.c.d/mask of one network).
+
+Ranges are swept in start order. A subnet is active from its start until a
+later start passes its end; every subnet starting while another is active
+shares addresses with it, so each active subnet met is one output pair:
+O(n log n + pairs). 07_neo4j-import.sh imports overlaps.csv(.gz) when present.
+"""
+
+import argparse, gzip, heapq, sys, time
+
+from subnet_cidr import cidr_range
+
+
+def open_text(filename, mode='r'):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', 1)
+    return open(filename, mode)
+
+
+def read_subnets(filename):
+    # (start, end, node id) of every subnet. string ids are the first
+    # column, integer ids (--id-type integer) the subnet_num column
+    f = open_text(filename)
+    integer = 'ID(Subnet)' in f.readline()
+    subnets = []
+    for line in f:
+        fields = line.rstrip('\n').split(',')
+        if not fields[0]:
+            continue
+        start, end = cidr_range(fields[0])
+        subnets.append((start, end, fields[1] if integer else fields[0]))
+    f.close()
+    return subnets, integer
+
+
+def sweep(subnets):
+    # yields (outer id, inner id, type) of every pair sharing addresses
+    subnets.sort(key=lambda subnet: (subnet[0], -subnet[1]))
+    ends = []
+    active = {}
+    for position, (start, end, node) in enumerate(subnets):
+        while ends and ends[0][0] < start:
+            active.pop(heapq.heappop(ends)[1])
+        for other in active:
+            other_start, other_end, other_node = subnets[other]
+            if other_end >= end and (other_start, other_end) != (start, end):
+                yield other_node, node, 'CONTAINS'
+            else:
+                yield other_node, node, 'OVERLAPS'
+        active[position] = None
+        heapq.heappush(ends, (end, position))
+
+
+def write_overlaps(subnets, integer, filename):
+    f = open_text(filename, 'w')
+    if integer:
+        f.write(':START_ID(Subnet),:END_ID(Subnet),:TYPE\n')
+        rows = ('%s,%s,%s\n' % pair for pair in sweep(subnets))
+    else:
+        f.write(':START_ID,:END_ID,:TYPE\n')
+        rows = ('"%s","%s",%s\n' % pair for pair in sweep(subnets))
+    count = 0
+    for row in rows:
+        f.write(row)
+        count += 1
+    f.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CONTAINS/OVERLAPS relationships '
+                                     'between subnets sharing ip addresses')
+    parser.add_argument('--subnets', default='subnets.csv')
+    parser.add_argument('--output', default='overlaps.csv',
+                        help='relationships file, gzip compressed when it ends with .gz')
+    opts = parser.parse_args()
+
+    started = time.time()
+    subnets, integer = read_subnets(opts.subnets)
+    count = write_overlaps(subnets, integer, opts.output)
+    print("%d subnets, %d overlapping pairs written to %s in %.2fs" %
+          (len(subnets), count, opts.output, time.time() - started), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
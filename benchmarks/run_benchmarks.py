@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py times the subnet generator (06) and the three phases of
+data_exploration/data_object_explore.py on deterministic synthetic inputs.
+
+Every benchmark runs in its own process and temporary directory. Inputs are
+built there before the clock starts, only the measured call is timed. For
+each benchmark the rows processed, wall time, rows/sec and peak RSS of the
+process (input setup included) are reported, and all results can be saved as a JSON baseline:
+
+    python3 benchmarks/run_benchmarks.py --scale small --save base.json
+    python3 benchmarks/run_benchmarks.py --scale small --compare base.json
+
+Scales are rows of the explore CSV and calls of the micro benchmarks. The
+generator works with subnets, one subnet per SUBNET_ROWS rows (a /23../29
+subnet expands to ~100 host rows), so every scale writes a similar amount.
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from multiprocessing import Process, Queue
+from time import perf_counter, strftime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCALES = {"small": 1000, "medium": 100000, "large": 10000000}
+SEED = 42
+SUBNET_ROWS = 100
+# explore CSV files processed in phase1, merged by merge_files
+CSV_FILES = 4
+# distinct values of the explore CSV columns, None is one value per row
+CSV_COLUMNS = [("id", None), ("name", 0.5), ("address", 0.3), ("city", 0.01), \
+               ("country", 0.001), ("amount", 0.1)]
+CSV_PIVOTS = ["id"]
+# slower by more than this fraction of the baseline is reported as regression
+TOLERANCE = 0.10
+
+
+def load_generator():
+    ''' load_generator imports 06_random_subnets_with_nodes_parallel.py '''
+    spec = importlib.util.spec_from_file_location( \
+        "subnets_generator", os.path.join(ROOT, "06_random_subnets_with_nodes_parallel.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_explore():
+    ''' load_explore imports data_exploration/data_object_explore.py '''
+    sys.path.insert(0, os.path.join(ROOT, "data_exploration"))
+    import data_object_explore
+    return data_object_explore
+
+
+gen = load_generator()
+explore = load_explore()
+
+
+def count_lines(file_name):
+    ''' count_lines returns the number of data lines (header excluded) '''
+    with open(file_name, "rb") as my_file:
+        return sum(1 for _ in my_file) - 1
+
+
+def count_records(file_name):
+    ''' count_records returns data lines of a CSV or records of a phase1 .bin file '''
+    if not file_name.endswith(".bin"):
+        return count_lines(file_name)
+    data, header = explore.map_binary(file_name)
+    if header[0] == b"o":
+        count = sum(1 for _ in explore.read_binary_objects(data, header))
+    else:
+        count = sum(1 for _ in explore.read_binary_relations(data, header))
+    data.close()
+    return count
+
+
+def make_values(rng, count, size=12):
+    ''' make_values returns count random strings with some dirt for clean_data '''
+    letters = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    dirt = ["", "", "", " ", "  ", "\"", "'", "\t", "\xe9"]
+    return [rng.choice(dirt) + "".join(rng.choice(letters) for _ in range(size)) \
+            + rng.choice(dirt) for _ in range(count)]
+
+
+def make_csv(rows, seed=SEED, files=CSV_FILES):
+    '''
+    make_csv writes rows data rows of CSV_COLUMNS into files csv files in the
+    working directory and returns their names. Values repeat with the column
+    cardinality and ~5% of cells are empty.
+    '''
+
+    rng = random.Random(seed)
+    pools = []
+    for name, ratio in CSV_COLUMNS:
+        if ratio is None:
+            pools.append(None)
+        else:
+            pools.append(make_values(rng, max(int(rows * ratio), 1)))
+
+    names = ["bench%d.csv" % idx for idx in range(files)]
+    per_file = -(-rows // files)
+    row_id = 0
+    for name in names:
+        with open(name, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([column for column, _ in CSV_COLUMNS])
+            for _ in range(min(per_file, rows - row_id)):
+                cells = [str(row_id)]
+                for pool in pools[1:]:
+                    cells.append("" if rng.random() < 0.05 else rng.choice(pool))
+                writer.writerow(cells)
+                row_id += 1
+    return names
+
+
+def run_phase1_files(names):
+    ''' run_phase1_files writes phase1 outputs of names into ./input '''
+    os.mkdir("input")
+    for name in names:
+        explore.process_csv_file(name, pivots=CSV_PIVOTS, autopivot=False)
+
+
+def bench_generate_subnets(rows, engine):
+    ''' generate one shard of rows // SUBNET_ROWS subnets '''
+    loop = max(rows // SUBNET_ROWS, 1)
+    worker = gen.engines[engine]
+
+    # every host is one relationships row, the worker returns their count
+    def run():
+        return worker(loop, seed=SEED)
+    return run
+
+
+def bench_int2ip(rows):
+    ''' int2ip of rows deterministic ip numbers '''
+    rng = random.Random(SEED)
+    numbers = [rng.randint(0, 2 ** 32 - 1) for _ in range(rows)]
+
+    def run():
+        int2ip = gen.int2ip
+        for number in numbers:
+            int2ip(number)
+        return len(numbers)
+    return run
+
+
+def bench_merge(rows, dedup):
+    ''' merge_shards of two generated shards (rows // SUBNET_ROWS subnets) '''
+    step = max(rows // SUBNET_ROWS // 2, 1)
+    for loop in (2 * step, step):
+        gen.generate_subnets(loop, seed=SEED)
+    shards = [name for name in os.listdir(".") if name.endswith(".csv")]
+    lines = sum(count_lines(name) for name in shards)
+    bitmap_file = "bitmap.bin" if dedup == "bitmap" else None
+
+    def run():
+        gen.merge_shards(2 * step, step, dedup, bitmap_file, 64 << 20, ".")
+        return lines
+    return run
+
+
+def bench_clean_data(rows):
+    ''' clean_data of rows cells, one distinct value per 10 cells '''
+    rng = random.Random(SEED)
+    pool = make_values(rng, max(rows // 10, 1))
+    cells = [rng.choice(pool) for _ in range(rows)]
+    explore.clean_data.cache_clear()
+
+    def run():
+        clean_data = explore.clean_data
+        for cell in cells:
+            clean_data(cell)
+        return len(cells)
+    return run
+
+
+def bench_get_pivots(rows):
+    ''' get_pivots with autopivot of one csv file of rows rows '''
+    name, = make_csv(rows, files=1)
+
+    def run():
+        explore.get_pivots(name, pivots=[], autopivot=True)
+        return rows
+    return run
+
+
+def bench_get_objects_and_rel(rows):
+    ''' get_objects_and_rel_from_csv of one csv file of rows rows '''
+    name, = make_csv(rows, files=1)
+
+    def run():
+        explore.get_objects_and_rel_from_csv(name, CSV_PIVOTS)
+        return rows
+    return run
+
+
+def bench_write_obj_rel(rows, binary=False):
+    ''' write_obj_rel of objects and relations parsed from rows rows '''
+    explore.BINARY_INTERMEDIATE = binary
+    name, = make_csv(rows, files=1)
+    maps = explore.get_objects_and_rel_from_csv(name, CSV_PIVOTS)
+    os.mkdir("input")
+
+    def run():
+        explore.write_obj_rel(*maps, suffix=name, folder="input")
+        return rows
+    return run
+
+
+def bench_merge_files(rows, binary=False, mode=None):
+    ''' merge_files (phase2) of phase1 outputs of CSV_FILES csv files '''
+    explore.BINARY_INTERMEDIATE = binary
+    run_phase1_files(make_csv(rows))
+    files_prefix = explore.get_files_prefixes("input")
+    lines = sum(count_records(os.path.join("input", name)) \
+                for files in files_prefix.values() for name in files)
+
+    def run():
+        for prefix, files in files_prefix.items():
+            explore.merge_files(prefix, files, "input", mode=mode)
+        return lines
+    return run
+
+
+def bench_connect_pivots(rows, binary=False):
+    ''' connect_pivots (phase3) of the merged objects of rows rows '''
+    explore.BINARY_INTERMEDIATE = binary
+    run_phase1_files(make_csv(rows))
+    explore.run_phase2("input")
+    files = explore.get_files_prefixes("input")[explore.OBJECT_FILE_PREFIX]
+    lines = sum(count_records(os.path.join("input", name)) for name in files)
+
+    def run():
+        explore.connect_pivots(explore.PIVOT_FILE_PREFIX, files, "input")
+        return lines
+    return run
+
+
+BENCHMARKS = {
+    "generate_subnets": lambda rows: bench_generate_subnets(rows, "python"),
+    "generate_subnets_numpy": lambda rows: bench_generate_subnets(rows, "numpy"),
+    "int2ip": bench_int2ip,
+    "merge_lines": lambda rows: bench_merge(rows, "lines"),
+    "merge_external": lambda rows: bench_merge(rows, "external"),
+    "merge_bitmap": lambda rows: bench_merge(rows, "bitmap"),
+    "clean_data": bench_clean_data,
+    "get_pivots": bench_get_pivots,
+    "get_objects_and_rel_from_csv": bench_get_objects_and_rel,
+    "write_obj_rel": bench_write_obj_rel,
+    "write_obj_rel_binary": lambda rows: bench_write_obj_rel(rows, binary=True),
+    "merge_files": bench_merge_files,
+    "merge_files_binary": lambda rows: bench_merge_files(rows, binary=True),
+    "merge_files_parallel": lambda rows: bench_merge_files(rows, mode="parallel"),
+    "connect_pivots": bench_connect_pivots,
+    "connect_pivots_binary": lambda rows: bench_connect_pivots(rows, binary=True),
+}
+
+
+def peak_rss_kb():
+    ''' peak_rss_kb returns the peak resident set size of this process in KB '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_one(name, rows, results):
+    '''
+    run_one runs benchmark name in a temporary working directory, progress
+    printed by the benchmarked code is discarded
+    '''
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            run = BENCHMARKS[name](rows)
+            start = perf_counter()
+            done = run()
+            seconds = perf_counter() - start
+        results.put({"rows": done, "seconds": round(seconds, 6), \
+                     "rows_per_sec": round(done / seconds if seconds else 0.0, 1), \
+                     "peak_rss_kb": peak_rss_kb()})
+    except Exception as err:
+        results.put({"error": "%s: %s" % (type(err).__name__, err)})
+        raise
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmarks(names, rows):
+    ''' run_benchmarks runs names one process each and returns their results '''
+    report = {}
+    for name in names:
+        results = Queue()
+        proc = Process(target=run_one, args=(name, rows, results))
+        proc.start()
+        proc.join()
+        result = results.get() if not results.empty() else \
+            {"error": "exit code %s" % proc.exitcode}
+        report[name] = result
+        print_result(name, result)
+    return report
+
+
+def print_result(name, result, baseline=None):
+    ''' print_result prints one line of results, compared to baseline if any '''
+    if "error" in result:
+        print("%-30s %s" % (name, result["error"]))
+        return
+    line = "%-30s %12d rows %10.3f s %14.1f rows/s %10d KB" % \
+        (name, result["rows"], result["seconds"], result["rows_per_sec"], \
+         result["peak_rss_kb"])
+    if baseline and "rows_per_sec" in baseline and baseline["rows_per_sec"]:
+        ratio = result["rows_per_sec"] / baseline["rows_per_sec"]
+        line += "  %5.2fx" % ratio
+        if ratio < 1 - TOLERANCE:
+            line += " REGRESSION"
+    print(line, flush=True)
+
+
+def main():
+    global TOLERANCE
+    parser = argparse.ArgumentParser(description="benchmark the subnet generator "
+                                     "and the data exploration phases")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--rows", type=int, help="rows instead of a named scale")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        metavar="NAME", help="benchmarks to run (default all)")
+    parser.add_argument("--save", metavar="JSON", help="save results as a baseline")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="compare rows/sec with a saved baseline, exit 1 "
+                        "on regressions over --tolerance")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    opts = parser.parse_args()
+
+    TOLERANCE = opts.tolerance
+    rows = opts.rows or SCALES[opts.scale]
+    names = opts.only or sorted(BENCHMARKS)
+    if gen.np is None:
+        names = [name for name in names if name != "generate_subnets_numpy"]
+
+    print("%d rows, seed %d, python %s" % (rows, SEED, platform.python_version()))
+    results = run_benchmarks(names, rows)
+    report = {"rows": rows, "seed": SEED, "date": strftime("%Y-%m-%d %H:%M:%S"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "results": results}
+
+    if opts.save:
+        with open(opts.save, "w") as out_file:
+            json.dump(report, out_file, indent=2, sort_keys=True)
+
+    if opts.compare:
+        with open(opts.compare) as in_file:
+            baseline = json.load(in_file)
+        if baseline["rows"] != rows:
+            print("baseline has %d rows, not comparable" % baseline["rows"])
+            sys.exit(2)
+        print("\ncompared to %s (%s)" % (opts.compare, baseline.get("date")))
+        regressions = 0
+        for name, result in results.items():
+            previous = baseline["results"].get(name)
+            print_result(name, result, previous)
+            if previous and "rows_per_sec" in result and previous.get("rows_per_sec") \
+                and result["rows_per_sec"] < previous["rows_per_sec"] * (1 - TOLERANCE):
+                regressions += 1
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
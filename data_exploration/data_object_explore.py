@@ -8,6 +8,8 @@ neo4j-admin import --mode=csv \
  --relationships=r__merged.csv \
  --relationships=p.csv
 
+(o___merged.csv.gz, r___merged.csv.gz and p.csv.gz with COMPRESS).
+
 Each object/vertex has two properties: TYPE and VALUE,
   where TYPE is CSV header field and VALUE is a cell CSV value.
 
@@ -41,12 +43,28 @@ Explore all shortest paths since there can be phantom connections that do not
 really exist and can lead to fake results.
 """
 
+from array import array
+from cProfile import Profile
 from csv import reader as csvreader
+from functools import lru_cache
+from gzip import GzipFile
+from heapq import merge as heapmerge
+from io import BufferedWriter, StringIO, TextIOWrapper
+from json import dump as json_dump, dumps as json_dumps, load as json_load
+from mmap import mmap, ACCESS_READ
 from multiprocessing import cpu_count, Pool
-from os import path, walk, unlink
-from re import sub as resub
+from os import getpid, path, replace, stat, walk, unlink
+from queue import Queue
+from tempfile import NamedTemporaryFile
+from re import compile as recompile, sub as resub
+from shutil import copyfileobj
+from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
 from string import printable
-from hashlib import new as hashlib
+from struct import Struct
+from hashlib import blake2b, new as hashlib
+from threading import Event, Thread
+from time import time
+from zlib import crc32
 
 SPLITTER = "___"
 OBJECT_FILE_PREFIX = "o"
@@ -54,31 +72,241 @@ RELATIONS_FILE_PREFIX = "r"
 PIVOT_FILE_PREFIX = "p"
 SEP = ","
 VERBOSE = False
-
-
+MERGE_MODE = "set"
+MERGE_MEMORY_BUDGET = 256 * 1024 * 1024
+MERGE_MAX_RUNS = 128
+# MERGE_MODE "parallel" dedups MERGE_PARTITIONS hash partitions of the lines
+# in worker processes (see merge_files_parallel), None is one per core
+MERGE_PARTITIONS = None
+CONNECT_INDEX_BUDGET = 256 * 1024 * 1024
+SINGLE_PASS = False
+CLEAN_CACHE_SIZE = 64 * 1024
+# object ids: "sha1" (40 hex chars), "blake2b" (ID_DIGEST_SIZE bytes in hex)
+# or "dense" (0, 1, 2, ... from ID_TABLE, numbered within one process)
+ID_SCHEME = "sha1"
+ID_DIGEST_SIZE = 8
+ID_CACHE_SIZE = 1024 * 1024
+ID_TABLE = {}
+# with PARALLEL_PARSE, files from PARALLEL_MIN_SIZE bytes are parsed in
+# PARALLEL_CHUNK_SIZE pieces, split only outside of quoted fields
+PARALLEL_PARSE = False
+PARALLEL_MIN_SIZE = 256 * 1024 * 1024
+PARALLEL_CHUNK_SIZE = 64 * 1024 * 1024
+# COMPACT_MAPS parses files into interned values and packed edge arrays
+# (see get_objects_and_rel_compact), every COMPACT_EDGES new edges are
+# deduplicated into a sorted run, runs are merged as they grow
+COMPACT_MAPS = False
+COMPACT_EDGES = 1024 * 1024
+# STREAM_OUTPUT writes objects and relations while the CSV is read (see
+# write_obj_rel_stream), duplicates are left for phase2 except those among
+# the last STREAM_SEEN_SIZE ones, files are written through
+# STREAM_BUFFER_SIZE buffers
+STREAM_OUTPUT = False
+STREAM_SEEN_SIZE = 256 * 1024
+STREAM_BUFFER_SIZE = 4 * 1024 * 1024
+
+# COMPRESS writes object, relation and pivot files gzip compressed at
+# COMPRESS_LEVEL through COMPRESS_BUFFER_SIZE buffers, their names end with
+# .gz. phase2 and phase3 read .gz files transparently, see open_text
+COMPRESS = False
+COMPRESS_LEVEL = 1
+COMPRESS_BUFFER_SIZE = 1024 * 1024
+
+# BINARY_INTERMEDIATE writes phase1 objects and relations as packed records
+# (see write_obj_rel_binary) into .bin files, read back by phase2 and phase3
+# through mmap. Only the merged and pivot files are written as CSV.
+# A .bin file is BINARY_HEADER, the records and the table of object types
+# at table offset. An object is id, BINARY_OBJECT (type code, value length)
+# and the utf-8 value, a relation is start id and end id. Ids are digests
+# (hex in CSV) or, with dense ids, little endian integers of 8 bytes
+BINARY_INTERMEDIATE = False
+BINARY_MAGIC = b"OBJREL01"
+# magic, kind (b"o" or b"r"), dense ids, id width, table offset
+BINARY_HEADER = Struct("<8sc?HQ")
+BINARY_OBJECT = Struct("<HI")
+BINARY_TYPE = Struct("<H")
+# merge_files_binary writes CSV lines in batches of MERGE_BATCH
+MERGE_BATCH = 64 * 1024
+
+# phase1 jobs: (csv file, pivots, whitelist, autopivot)
+PHASE1_JOBS = [("2007-30.csv", ['whatever_since_autopivot_is_true'], ['*'], True), \
+               #("2007.csv", ['whatever_since_autopivot_is_true'], ['*'], True), \
+               ("a.csv", ['whatever_since_autopivot_is_true'], ['*'], True)]
+# a phase1 job is expected to need PHASE1_MEMORY_FACTOR times its csv size,
+# jobs running at once stay within PHASE1_MEMORY_BUDGET
+PHASE1_MEMORY_FACTOR = 10
+PHASE1_MEMORY_BUDGET = 8 * 1024 * 1024 * 1024
+# incremental runs keep phase1 outputs and skip unchanged inputs, see
+# run_incremental. STATE_FILE in the output folder records what was done
+INCREMENTAL = False
+STATE_FILE = "state.json"
+# STATS times every phase and counts rows read, cells cleaned, hashes
+# computed, objects and edges emitted and bytes written (see get_stats).
+# phase1 jobs print progress every PROGRESS_INTERVAL seconds, the report is
+# saved as JSON into STATS_FILE. PROFILE_DIR dumps cProfile stats of each job
+STATS = False
+STATS_FILE = "stats.json"
+PROGRESS_INTERVAL = 30
+PROFILE_DIR = None
+# counters of this process, see get_stats. cells and hashes hold those of
+# phase1 pool workers, cells and hashes of this process come from its caches
+STATS_COUNTERS = dict.fromkeys(("rows", "cells", "hashes", "objects", "edges", "bytes"), 0)
+STATS_REPORT = {"phases": {}, "workers": []}
+
+# clean_data keeps printable ascii except quotes and commas, the translate
+# table deletes the rest of ascii, non-ascii is dropped before translating
+CLEAN_KEEP = set(printable) - set(["'", '"', ','])
+CLEAN_TABLE = dict((code, None) for code in range(128) if chr(code) not in CLEAN_KEEP)
+TRAILING_SPACES = recompile(' *$')
+
+
+@lru_cache(maxsize=CLEAN_CACHE_SIZE)
 def clean_data(my_string):
     '''
     clean_data cleans my_string argument. It removes non-printable characters,
     specific csv characters and replaces empty chars in beginning and end.
     It also removes 'spliiter', specific string used for objects and relations.
+    Results are cached, csv columns repeat the same values a lot.
     '''
 
-    rexes = ['^ *', ' *$', SPLITTER]
-    char_to_remove = ["'", '"', ',']
-    clean_s = ''
-    for char in my_string:
-        if char in printable and char not in char_to_remove:
-                clean_s += char
-    for regex in rexes:
-        clean_s = resub(regex, '', clean_s)
+    if not my_string.isascii():
+        my_string = my_string.encode("ascii", "ignore").decode("ascii")
+    clean_s = my_string.translate(CLEAN_TABLE).lstrip(' ')
+    # ' *$' also matches before a final newline, rstrip would not
+    if clean_s.endswith('\n'):
+        clean_s = TRAILING_SPACES.sub('', clean_s)
+    else:
+        clean_s = clean_s.rstrip(' ')
+    if SPLITTER in clean_s:
+        clean_s = clean_s.replace(SPLITTER, '')
     return clean_s
 
 
+def clean_row(row):
+    ''' clean_row returns the list of clean_data values of all row cells '''
+    STATS_COUNTERS["rows"] += 1
+    return list(map(clean_data, row))
+
+
 def log_me(string):
     ''' print string to STDOUT '''
     print(string)
 
 
+def out_name(file_name):
+    ''' out_name returns name of output file_name, .gz is added with COMPRESS '''
+    return file_name + ".gz" if COMPRESS else file_name
+
+
+def open_text(file_name, mode="r", buffering=-1):
+    '''
+    open_text opens file_name in text mode, names ending with .gz are gzip
+    (de)compressed. Written gzip data goes through COMPRESS_BUFFER_SIZE buffer.
+    '''
+
+    if not file_name.endswith(".gz"):
+        return open(file_name, mode, buffering=buffering)
+    if mode == "r":
+        return TextIOWrapper(GzipFile(file_name, "rb"))
+    return TextIOWrapper(BufferedWriter(GzipFile(file_name, mode + "b", COMPRESS_LEVEL), \
+                                        COMPRESS_BUFFER_SIZE))
+
+
+def count_output(objects, edges, *file_names):
+    ''' count_output adds emitted objects, edges and sizes of file_names to STATS_COUNTERS '''
+    STATS_COUNTERS["objects"] += objects
+    STATS_COUNTERS["edges"] += edges
+    STATS_COUNTERS["bytes"] += sum(path.getsize(name) for name in file_names \
+                                   if path.isfile(name))
+
+
+def get_stats():
+    '''
+    get_stats returns counters of this process: rows read (every pass counts),
+    cells cleaned, hashes computed, objects and edges emitted, bytes written
+    and peak RSS in KB. Counters of phase1 pool workers are included once
+    their jobs finish (see add_worker_stats), chunk workers of
+    get_objects_and_rel_parallel count in their own processes and are not.
+    '''
+
+    stats = dict(STATS_COUNTERS)
+    clean_info = clean_data.cache_info()
+    stats["cells"] += clean_info.hits + clean_info.misses
+    stats["hashes"] += gen_hash_for_object.cache_info().misses
+    stats["peak_rss_kb"] = getrusage(RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+def add_worker_stats(reports):
+    '''
+    add_worker_stats adds counters of phase1 job reports run by other
+    processes to STATS_COUNTERS, so phases timed here include their work
+    '''
+    for report in reports:
+        if report.get("stats") and report.get("pid") != getpid():
+            for name in STATS_COUNTERS:
+                STATS_COUNTERS[name] += report["stats"][name]
+
+
+def diff_stats(before, after):
+    ''' diff_stats returns counters gained between two get_stats calls '''
+    return dict((name, value if name == "peak_rss_kb" else value - before[name]) \
+                for name, value in after.items())
+
+
+def start_progress(label, started=None):
+    '''
+    start_progress prints counters of this process every PROGRESS_INTERVAL
+    seconds until the returned event is set
+    '''
+
+    started = started or time()
+    before = get_stats()
+    stop = Event()
+
+    def report():
+        while not stop.wait(PROGRESS_INTERVAL):
+            stats = diff_stats(before, get_stats())
+            elapsed = time() - started
+            log_me("Progress: {}, {:.0f}s, rows: {} ({:.0f}/s), cells: {}, hashes: {}, " \
+                   "rss: {} KB".format(label, elapsed, stats["rows"], \
+                                       stats["rows"] / elapsed, stats["cells"], \
+                                       stats["hashes"], stats["peak_rss_kb"]))
+
+    Thread(target=report, daemon=True).start()
+    return stop
+
+
+def timed_phase(name, func, *args, **kwargs):
+    '''
+    timed_phase runs func and, with STATS on, records its duration and
+    counters of this process as phase name in STATS_REPORT
+    '''
+
+    if not STATS:
+        return func(*args, **kwargs)
+    before = get_stats()
+    start = time()
+    result = func(*args, **kwargs)
+    phase = diff_stats(before, get_stats())
+    phase["duration"] = time() - start
+    STATS_REPORT["phases"][name] = phase
+    log_me("Stats: {} {}".format(name, json_dumps(phase, sort_keys=True)))
+    return result
+
+
+def save_stats(stats_file=None):
+    '''
+    save_stats writes STATS_REPORT with peak RSS of this process and of its
+    children into stats_file (STATS_FILE)
+    '''
+
+    STATS_REPORT["peak_rss_kb"] = {"main": getrusage(RUSAGE_SELF).ru_maxrss, \
+                                   "children": getrusage(RUSAGE_CHILDREN).ru_maxrss}
+    with open(stats_file or STATS_FILE, "w") as my_file:
+        json_dump(STATS_REPORT, my_file, indent=2, sort_keys=True)
+
+
 def get_pivots(csv_file, pivots=['name', 'address'], delim=",", \
     whitelist=['*'], enc="utf-8", omit_empty_nodes=True, autopivot=False):
     '''
@@ -98,9 +326,8 @@ def get_pivots(csv_file, pivots=['name', 'address'], delim=",", \
     with open(csv_file, "r", encoding=enc) as csvfile:
         data = csvreader(csvfile, delimiter=delim)
         for row in data:
-            for row_idx, row_value in enumerate(row):
+            for row_idx, data in enumerate(clean_row(row)):
 
-                data = clean_data(row_value)
                 if omit_empty_nodes and data == "":
                     continue
 
@@ -118,6 +345,15 @@ def get_pivots(csv_file, pivots=['name', 'address'], delim=",", \
 
             line_reads += 1
 
+    return resolve_pivots(csv_file, header_map, user_pivot_idx, pivots, autopivot)
+
+
+def resolve_pivots(csv_file, header_map, user_pivot_idx, pivots, autopivot):
+    '''
+    resolve_pivots returns user pivots, or picks autopivots from header_map
+    (column index -> list of rows having a value in that column).
+    '''
+
     if not autopivot:
         got_all = (len(pivots) == len(user_pivot_idx)) and header_map
         log_me("CSVFile: {}, AutoPivot: {}, Got all pivots: {}, \
@@ -165,7 +401,7 @@ def algo_pick_longest(header_map):
 
 
 def get_objects_and_rel_from_csv(csv_file, pivots, delim=",", whitelist=['*'], \
-    enc="utf-8", omit_empty_nodes=True, autopivot=False):
+    enc="utf-8", omit_empty_nodes=True, autopivot=False, single_pass=None):
     '''
     get_objects_and_rel_from_csv will read csv_file with header and creates
     unique objects and relations.
@@ -173,8 +409,19 @@ def get_objects_and_rel_from_csv(csv_file, pivots, delim=",", whitelist=['*'], \
     Relations are created within same row between pivots and non-pivots fields.
     Pivots is a list of strings - fields in csv header.
     Whitelist is a list of strings, fields in csv header.
+    single_pass (SINGLE_PASS by default) reads csv_file only once, see
+    get_objects_and_rel_single_pass.
     '''
 
+    if single_pass is None:
+        single_pass = SINGLE_PASS
+    if single_pass:
+        return get_objects_and_rel_single_pass(csv_file=csv_file, pivots=pivots, \
+                                               delim=delim, whitelist=whitelist, \
+                                               enc=enc, \
+                                               omit_empty_nodes=omit_empty_nodes, \
+                                               autopivot=autopivot)
+
     line_reads = 0
     header_map = {}
     object_map = {}
@@ -190,52 +437,490 @@ def get_objects_and_rel_from_csv(csv_file, pivots, delim=",", whitelist=['*'], \
         data = csvreader(csvfile, delimiter=delim)
         for row in data:
             line_reads += 1
+            clean = clean_row(row)
 
-            for row_idx, row_value in enumerate(row):
-                data = clean_data(row_value)
+            #data row, not header
+            if line_reads > 1:
+                add_row_objects_and_rel(clean, whitelist_field_ids, pivot_idx, \
+                                        object_map, relations_map, omit_empty_nodes)
+                continue
+
+            for row_idx, data in enumerate(clean):
 
                 if omit_empty_nodes and data == "":
                     continue
 
-                #header, not data
-                if line_reads == 1:
+                # ignore non whitelisted fields
+                for wl_field in whitelist:
+                    if wl_field in ('*', data):
+
+                        whitelist_field_ids.add(row_idx)
+                        header_map[row_idx] = data
+                        object_map[row_idx] = set()
+
+                        #each pivot refers to other non-pivot fields
+                        for pivot_id in pivot_idx:
+                            if row_idx != pivot_id:
+                                relations_map[pivot_id] = {}
+
+    return header_map, object_map, relations_map
+
+
+def add_row_objects_and_rel(clean, whitelist_field_ids, pivot_idx, object_map, \
+                            relations_map, omit_empty_nodes=True):
+    '''
+    add_row_objects_and_rel adds objects and relations of one cleaned data
+    row into object_map and relations_map.
+    '''
+
+    for row_idx, data in enumerate(clean):
+
+        if omit_empty_nodes and data == "":
+            continue
+        if row_idx not in whitelist_field_ids:
+            continue
+        if data not in object_map[row_idx]:
+            object_map[row_idx].add(data)
+
+        # don't create relations between pivots
+        if row_idx in pivot_idx:
+            continue
+
+        for pivot_id in pivot_idx:
+            pivot_data = clean[pivot_id]
+            if omit_empty_nodes and pivot_data == "":
+                continue
+
+            if pivot_data not in relations_map[pivot_id].keys():
+                relations_map[pivot_id][pivot_data] = {}
+            if row_idx not in relations_map[pivot_id][pivot_data].keys():
+                relations_map[pivot_id][pivot_data][row_idx] = set()
+            # each pivot within the row refers to all other data within the row
+            relations_map[pivot_id][pivot_data][row_idx].add(data)
+
+
+def read_csv_header(csv_file, pivots, delim=",", whitelist=['*'], enc="utf-8", \
+    omit_empty_nodes=True):
+    '''
+    read_csv_header reads just the header line of csv_file. It returns
+    header_map, whitelisted field ids, user pivot ids and the byte offset of
+    the first data row.
+    '''
+
+    header_map = {}
+    whitelist_field_ids = set()
+    user_pivot_idx = set()
+
+    with open(csv_file, "rb") as csvfile:
+        header = csvfile.readline().decode(enc)
+        offset = csvfile.tell()
+
+    for row in csvreader([header], delimiter=delim):
+        for row_idx, data in enumerate(clean_row(row)):
+            if omit_empty_nodes and data == "":
+                continue
+            for wl_field in whitelist:
+                if wl_field in ('*', data):
+                    whitelist_field_ids.add(row_idx)
+                    header_map[row_idx] = data
+                if data in pivots:
+                    user_pivot_idx.add(row_idx)
+    return header_map, whitelist_field_ids, user_pivot_idx, offset
+
+
+def get_chunk_offsets(csv_file, start, chunks):
+    '''
+    get_chunk_offsets splits csv_file from byte start into up to chunks
+    byte ranges, each one starting at the beginning of a line. A line
+    starting inside a quoted field (odd count of quotes before it, escaped
+    quotes are doubled) is not a row, such splits are dropped.
+    '''
+
+    size = path.getsize(csv_file)
+    offsets = [start]
+    with open(csv_file, "rb") as csvfile:
+        for chunk in range(1, chunks):
+            csvfile.seek(start + (size - start) * chunk // chunks)
+            csvfile.readline()
+            offset = csvfile.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+
+        # count quotes between the splits, keep those outside of quotes
+        csvfile.seek(start)
+        quotes = 0
+        safe = [start]
+        for offset in offsets[1:]:
+            while csvfile.tell() < offset:
+                block = csvfile.read(min(PARALLEL_CHUNK_SIZE, offset - csvfile.tell()))
+                quotes += block.count(b'"')
+            if quotes % 2 == 0:
+                safe.append(offset)
+    safe.append(size)
+    return list(zip(safe, safe[1:]))
+
+
+def read_csv_chunk(csv_file, start, end, delim=",", enc="utf-8"):
+    ''' read_csv_chunk returns csv reader of rows between bytes start and end '''
+    with open(csv_file, "rb") as csvfile:
+        csvfile.seek(start)
+        raw = csvfile.read(end - start)
+    return csvreader(StringIO(raw.decode(enc), newline=None), delimiter=delim)
+
+
+def get_chunk_coverage(csv_file, start, end, whitelist_field_ids, delim=",", \
+    enc="utf-8", omit_empty_nodes=True):
+    '''
+    get_chunk_coverage returns column coverage (column index -> rows having
+    a value) of one chunk. Rows are numbered start + row in chunk, which is
+    unique across chunks.
+    '''
+
+    coverage_map = dict((row_idx, []) for row_idx in whitelist_field_ids)
+    for line_reads, row in enumerate(read_csv_chunk(csv_file, start, end, delim, enc)):
+        for row_idx, data in enumerate(clean_row(row)):
+            if omit_empty_nodes and data == "":
+                continue
+            if row_idx in coverage_map:
+                coverage_map[row_idx].append(start + line_reads)
+    return coverage_map
+
+
+def init_relations_map(whitelist_field_ids, pivot_idx):
+    ''' init_relations_map returns empty relations_map for known pivots '''
+    relations_map = {}
+    for row_idx in whitelist_field_ids:
+        #each pivot refers to other non-pivot fields
+        for pivot_id in pivot_idx:
+            if row_idx != pivot_id:
+                relations_map[pivot_id] = {}
+    return relations_map
+
+
+def get_chunk_objects_and_rel(csv_file, start, end, whitelist_field_ids, pivot_idx, \
+    delim=",", enc="utf-8", omit_empty_nodes=True):
+    ''' get_chunk_objects_and_rel returns object_map and relations_map of one chunk '''
+
+    object_map = dict((row_idx, set()) for row_idx in whitelist_field_ids)
+    relations_map = init_relations_map(whitelist_field_ids, pivot_idx)
+    for row in read_csv_chunk(csv_file, start, end, delim, enc):
+        add_row_objects_and_rel(clean_row(row), whitelist_field_ids, pivot_idx, \
+                                object_map, relations_map, omit_empty_nodes)
+    return object_map, relations_map
+
+
+def get_objects_and_rel_parallel(csv_file, pivots, delim=",", whitelist=['*'], \
+    enc="utf-8", omit_empty_nodes=True, autopivot=False, processes=None):
+    '''
+    get_objects_and_rel_parallel returns the same maps as
+    get_objects_and_rel_from_csv, but the file is split into newline aligned
+    byte ranges parsed by a pool of processes. Pivots come from the header,
+    autopivots from coverage gathered by a first parallel pass.
+    It creates its own pool, so it can not run inside a pool worker.
+    '''
+
+    header_map, whitelist_field_ids, user_pivot_idx, offset = \
+        read_csv_header(csv_file, pivots, delim=delim, whitelist=whitelist, \
+                        enc=enc, omit_empty_nodes=omit_empty_nodes)
+    processes = processes or max(cpu_count() - 1, 1)
+    chunks = max(processes, (path.getsize(csv_file) - offset) // PARALLEL_CHUNK_SIZE + 1)
+    ranges = get_chunk_offsets(csv_file, offset, chunks)
+
+    # coverage in header order, autopivot breaks ties by the first column
+    coverage_map = dict((row_idx, []) for row_idx in sorted(whitelist_field_ids))
+    object_map = dict((row_idx, set()) for row_idx in whitelist_field_ids)
+
+    with Pool(processes=processes) as pool:
+        if autopivot:
+            jobs = [(csv_file, start, end, whitelist_field_ids, delim, enc, \
+                     omit_empty_nodes) for start, end in ranges]
+            for part_coverage in pool.starmap(get_chunk_coverage, jobs):
+                for row_idx, rows in part_coverage.items():
+                    coverage_map[row_idx].extend(rows)
+
+        _, pivot_idx = resolve_pivots(csv_file, coverage_map, user_pivot_idx, \
+                                      pivots, autopivot)
+        del coverage_map
+        relations_map = init_relations_map(whitelist_field_ids, pivot_idx)
+
+        jobs = [(csv_file, start, end, whitelist_field_ids, pivot_idx, delim, enc, \
+                 omit_empty_nodes) for start, end in ranges]
+        for part_objects, part_relations in pool.starmap(get_chunk_objects_and_rel, jobs):
+            for row_idx, values in part_objects.items():
+                object_map[row_idx].update(values)
+            for pivot_id, pivot_values in part_relations.items():
+                for pivot_data, cells in pivot_values.items():
+                    if pivot_data not in relations_map[pivot_id]:
+                        relations_map[pivot_id][pivot_data] = cells
+                        continue
+                    for row_idx, values in cells.items():
+                        if row_idx not in relations_map[pivot_id][pivot_data]:
+                            relations_map[pivot_id][pivot_data][row_idx] = values
+                        else:
+                            relations_map[pivot_id][pivot_data][row_idx].update(values)
+
+    return header_map, object_map, relations_map
+
+
+def get_objects_and_rel_single_pass(csv_file, pivots, delim=",", whitelist=['*'], \
+    enc="utf-8", omit_empty_nodes=True, autopivot=False):
+    '''
+    get_objects_and_rel_single_pass returns the same maps as
+    get_objects_and_rel_from_csv, but reads and cleans csv_file only once.
+    The pass collects column coverage and objects and keeps every data row
+    as a tuple of cleaned values. Pivots are resolved afterwards and the
+    relations are built from these tuples, without parsing the text again.
+    Rows without the pivot cell (shorter than the header) are skipped.
+    '''
+
+    line_reads = 0
+    coverage_map = {}
+    user_pivot_idx = set()
+    header_map = {}
+    object_map = {}
+    relations_map = {}
+    whitelist_field_ids = set()
+    columns = ()
+    rows = []
+    values = {}
+
+    with open(csv_file, encoding=enc) as csvfile:
+        data = csvreader(csvfile, delimiter=delim)
+        for row in data:
+            line_reads += 1
+
+            #header, not data
+            if line_reads == 1:
+                for row_idx, data in enumerate(clean_row(row)):
+                    if omit_empty_nodes and data == "":
+                        continue
                     # ignore non whitelisted fields
                     for wl_field in whitelist:
                         if wl_field in ('*', data):
-
                             whitelist_field_ids.add(row_idx)
+                            coverage_map[row_idx] = []
                             header_map[row_idx] = data
                             object_map[row_idx] = set()
+                        if data in pivots:
+                            user_pivot_idx.add(row_idx)
+                # keep whitelisted columns, and user pivots if not whitelisted
+                columns = tuple(sorted(whitelist_field_ids | user_pivot_idx))
+                continue
+
+            #data row, not header, cells are cleaned here and not by clean_row
+            STATS_COUNTERS["rows"] += 1
+            row_len = len(row)
+            row_data = []
+            for row_idx in columns:
+                # short row, no cell
+                if row_idx >= row_len:
+                    row_data.append(None)
+                    continue
+                data = clean_data(row[row_idx])
+                data = values.setdefault(data, data)
+                row_data.append(data)
+
+                if omit_empty_nodes and data == "":
+                    continue
+                if row_idx not in whitelist_field_ids:
+                    continue
+                coverage_map[row_idx].append(line_reads - 1)
+                object_map[row_idx].add(data)
+            rows.append(tuple(row_data))
+
+    _, pivot_idx = resolve_pivots(csv_file, coverage_map, user_pivot_idx, \
+                                  pivots, autopivot)
+
+    #each pivot refers to other non-pivot fields
+    for row_idx in whitelist_field_ids:
+        for pivot_id in pivot_idx:
+            if row_idx != pivot_id:
+                relations_map[pivot_id] = {}
+
+    positions = dict((row_idx, pos) for pos, row_idx in enumerate(columns))
+    pivot_pos = [(pivot_id, positions[pivot_id]) for pivot_id in pivot_idx]
+    data_pos = [(row_idx, positions[row_idx]) for row_idx in columns \
+                if row_idx in whitelist_field_ids and row_idx not in pivot_idx]
+
+    for row_data in rows:
+        for pivot_id, p_pos in pivot_pos:
+            pivot_data = row_data[p_pos]
+            if pivot_data is None or (omit_empty_nodes and pivot_data == ""):
+                continue
+            for row_idx, d_pos in data_pos:
+                data = row_data[d_pos]
+                if data is None or (omit_empty_nodes and data == ""):
+                    continue
+                if pivot_data not in relations_map[pivot_id]:
+                    relations_map[pivot_id][pivot_data] = {}
+                if row_idx not in relations_map[pivot_id][pivot_data]:
+                    relations_map[pivot_id][pivot_data][row_idx] = set()
+                # each pivot within the row refers to all other data within the row
+                relations_map[pivot_id][pivot_data][row_idx].add(data)
+
+    return header_map, object_map, relations_map
+
+
+def merge_edge_runs(runs):
+    ''' merge_edge_runs returns one sorted unique packed edge array of sorted runs '''
+    if len(runs) == 1:
+        return runs[0]
+    merged = array('Q')
+    last = None
+    for edge in heapmerge(*runs):
+        if edge != last:
+            merged.append(edge)
+            last = edge
+    return merged
+
+
+def compact_edges(edges):
+    '''
+    compact_edges sorts and dedups the new tail of edges ([runs, tail]) into
+    a run of its own. Runs are merged while the previous one is at most twice
+    the size of the last, so every edge is merged O(log n) times and the
+    compacted runs are never sorted again.
+    '''
+
+    runs = edges[0]
+    runs.append(array('Q', sorted(set(edges[1]))))
+    edges[1] = array('Q')
+    while len(runs) > 1 and len(runs[-2]) <= 2 * len(runs[-1]):
+        runs[-2:] = [merge_edge_runs(runs[-2:])]
 
-                            #each pivot refers to other non-pivot fields
+
+def get_objects_and_rel_compact(csv_file, pivots, delim=",", whitelist=['*'], \
+    enc="utf-8", omit_empty_nodes=True, autopivot=False):
+    '''
+    get_objects_and_rel_compact parses csv_file like get_objects_and_rel_from_csv,
+    but keeps much less in memory. Each cleaned value is stored once in a
+    per-column value table and referred to by its index. Relations are
+    packed as pivot value index << 32 | value index into array('Q') buffers,
+    one per (pivot column, column), deduplicated into sorted runs (see
+    compact_edges).
+    Returns header_map, value_tables (column -> list of values) and
+    edge_map ((pivot column, column) -> sorted unique packed edges), to be
+    written by write_obj_rel_compact. Whitelisted value tables are the objects.
+    '''
+
+    line_reads = 0
+    header_map = {}
+    value_tables = {}
+    value_ids = {}
+    edge_map = {}
+    whitelist_field_ids = set()
+
+    _, pivot_idx = get_pivots(csv_file=csv_file, pivots=pivots, \
+                                    delim=delim, whitelist=whitelist, \
+                                    enc=enc, omit_empty_nodes=omit_empty_nodes, \
+                                    autopivot=autopivot)
+    for pivot_id in pivot_idx:
+        value_tables[pivot_id] = []
+        value_ids[pivot_id] = {}
+
+    with open(csv_file, encoding=enc) as csvfile:
+        data = csvreader(csvfile, delimiter=delim)
+        for row in data:
+            line_reads += 1
+            clean = clean_row(row)
+
+            #header, not data
+            if line_reads == 1:
+                for row_idx, data in enumerate(clean):
+                    if omit_empty_nodes and data == "":
+                        continue
+                    # ignore non whitelisted fields
+                    for wl_field in whitelist:
+                        if wl_field in ('*', data):
+                            whitelist_field_ids.add(row_idx)
+                            header_map[row_idx] = data
+                            value_tables.setdefault(row_idx, [])
+                            value_ids.setdefault(row_idx, {})
                             for pivot_id in pivot_idx:
                                 if row_idx != pivot_id:
-                                    relations_map[pivot_id] = {}
+                                    edge_map[(pivot_id, row_idx)] = [[], array('Q')]
+                continue
 
-                #data row, not header
-                else:
-                    if row_idx not in whitelist_field_ids:
-                        continue
-                    if data not in object_map[row_idx]:
-                        object_map[row_idx].add(data)
+            for row_idx, data in enumerate(clean):
+                if omit_empty_nodes and data == "":
+                    continue
+                if row_idx not in whitelist_field_ids:
+                    continue
+                ids = value_ids[row_idx]
+                data_id = ids.get(data)
+                if data_id is None:
+                    data_id = ids[data] = len(ids)
+                    value_tables[row_idx].append(data)
+
+                # don't create relations between pivots
+                if row_idx in pivot_idx:
+                    continue
 
-                    # don't create relations between pivots
-                    if row_idx in pivot_idx:
+                for pivot_id in pivot_idx:
+                    pivot_data = clean[pivot_id]
+                    if omit_empty_nodes and pivot_data == "":
                         continue
+                    ids = value_ids[pivot_id]
+                    pivot_data_id = ids.get(pivot_data)
+                    if pivot_data_id is None:
+                        pivot_data_id = ids[pivot_data] = len(ids)
+                        value_tables[pivot_id].append(pivot_data)
+
+                    edges = edge_map[(pivot_id, row_idx)]
+                    edges[1].append(pivot_data_id << 32 | data_id)
+                    if len(edges[1]) >= COMPACT_EDGES:
+                        compact_edges(edges)
+
+    del value_ids
+    for key, edges in edge_map.items():
+        compact_edges(edges)
+        edge_map[key] = merge_edge_runs(edges[0])
+    return header_map, value_tables, edge_map
+
+
+def stream_csv_rows(csv_file, delim=",", enc="utf-8"):
+    ''' stream_csv_rows yields cleaned rows of csv_file, header first '''
+    with open(csv_file, encoding=enc) as csvfile:
+        for row in csvreader(csvfile, delimiter=delim):
+            yield clean_row(row)
 
-                    for pivot_id in pivot_idx:
-                        pivot_data = clean_data(row[pivot_id])
-                        if omit_empty_nodes and pivot_data == "":
-                            continue
 
-                        if pivot_data not in relations_map[pivot_id].keys():
-                            relations_map[pivot_id][pivot_data] = {}
-                        if row_idx not in relations_map[pivot_id][pivot_data].keys():
-                            relations_map[pivot_id][pivot_data][row_idx] = set()
-                        # each pivot within the row refers to all other data within the row
-                        relations_map[pivot_id][pivot_data][row_idx].add(data)
+def stream_obj_rel(rows, pivot_idx, whitelist=['*'], omit_empty_nodes=True):
+    '''
+    stream_obj_rel takes cleaned rows, header first, and yields objects as
+    (type, value, None, None) and relations as (pivot type, pivot value,
+    type, value) row by row, as get_objects_and_rel_from_csv would find them.
+    Nothing is deduplicated and nothing but the header is kept.
+    '''
 
-    return header_map, object_map, relations_map
+    header_map = {}
+    for header in rows:
+        for row_idx, data in enumerate(header):
+            if omit_empty_nodes and data == "":
+                continue
+            # ignore non whitelisted fields
+            for wl_field in whitelist:
+                if wl_field in ('*', data):
+                    header_map[row_idx] = data
+        break
+
+    for clean in rows:
+        for row_idx, data in enumerate(clean):
+            if omit_empty_nodes and data == "":
+                continue
+            if row_idx not in header_map:
+                continue
+            yield header_map[row_idx], data, None, None
+
+            # don't create relations between pivots
+            if row_idx in pivot_idx:
+                continue
+
+            for pivot_id in pivot_idx:
+                pivot_data = clean[pivot_id]
+                if omit_empty_nodes and pivot_data == "":
+                    continue
+                yield header_map[pivot_id], pivot_data, header_map[row_idx], data
 
 
 def algo_get_hash(string, algo="sha1", encoding="utf-8"):
@@ -245,13 +930,46 @@ def algo_get_hash(string, algo="sha1", encoding="utf-8"):
     return my_hash.hexdigest()
 
 
-def gen_uuid_for_object(object_name, object_value):
+def gen_uuid_for_object(object_name, object_value, scheme=None):
     '''
     gen_uuid_for_object will generate unique id for the object in the graph.
     name of object is tight with csv header field and cell value joined by SPLITTER.
+    scheme is one of ID_SCHEME values, ID_SCHEME by default.
     '''
-    my_hash = algo_get_hash(object_name + SPLITTER + object_value)
-    return my_hash
+    scheme = scheme or ID_SCHEME
+    if scheme == "dense":
+        key = object_name + SPLITTER + object_value
+        if key not in ID_TABLE:
+            ID_TABLE[key] = str(len(ID_TABLE))
+        return ID_TABLE[key]
+    return gen_hash_for_object(scheme, object_name, object_value)
+
+
+def gen_binary_id(object_name, object_value, scheme=None):
+    '''
+    gen_binary_id returns id of gen_uuid_for_object packed into id_width
+    bytes: the digest itself, dense ids as integers
+    '''
+    scheme = scheme or ID_SCHEME
+    if scheme == "dense":
+        return int(gen_uuid_for_object(object_name, object_value, scheme)).to_bytes(8, "little")
+    return gen_hash_for_object(scheme, object_name, object_value, True)
+
+
+@lru_cache(maxsize=ID_CACHE_SIZE)
+def gen_hash_for_object(scheme, object_name, object_value, raw=False):
+    '''
+    gen_hash_for_object returns the hash id of the object, raw digest bytes
+    with raw. The cache makes sure each object is hashed once per process,
+    not once per relation.
+    '''
+    name = object_name + SPLITTER + object_value
+    if scheme == "blake2b":
+        my_hash = blake2b(name.encode("utf-8"), digest_size=ID_DIGEST_SIZE)
+        return my_hash.digest() if raw else my_hash.hexdigest()
+    if raw:
+        return hashlib(scheme, name.encode("utf-8")).digest()
+    return algo_get_hash(name, algo=scheme)
 
 
 def print_obj_rel(header_map, object_map, relations_map):
@@ -284,21 +1002,36 @@ def write_obj_rel(header_map, object_map, relations_map, suffix=".csv", folder="
     there will be two files created - object file and realtion file.
     '''
 
-    object_file = OBJECT_FILE_PREFIX + SPLITTER + suffix
-    with open(path.join(folder, object_file), "w") as obj_file:
+    if BINARY_INTERMEDIATE:
+        objects = ((gen_binary_id(header_map[i], element), header_map[i], element) \
+                   for i in header_map for element in object_map[i])
+        relations = ((gen_binary_id(header_map[pivot_id], pivot_data), \
+                      gen_binary_id(header_map[row_idx], data)) \
+                     for pivot_id in relations_map \
+                     for pivot_data in relations_map[pivot_id] \
+                     for row_idx in relations_map[pivot_id][pivot_data] \
+                     for data in relations_map[pivot_id][pivot_data][row_idx])
+        write_obj_rel_binary(objects, relations, suffix, folder)
+        return
+
+    objects = edges = 0
+    object_file = out_name(OBJECT_FILE_PREFIX + SPLITTER + suffix)
+    with open_text(path.join(folder, object_file), "w") as obj_file:
         obj_file.write('{0}{1}{2}{1}{3}{4}'.format(":ID", SEP, "TYPE", "VALUE", "\n"))
         for i in header_map:
+            objects += len(object_map[i])
             for element in object_map[i]:
                 sha_id = gen_uuid_for_object(header_map[i], element)
                 obj_file.write(sha_id + SEP + str(header_map[i]) + SEP + element + "\n")
 
-    rel_file = RELATIONS_FILE_PREFIX + SPLITTER + suffix
-    with open(path.join(folder, rel_file), "w") as rel_file:
+    rel_file = out_name(RELATIONS_FILE_PREFIX + SPLITTER + suffix)
+    with open_text(path.join(folder, rel_file), "w") as rel_file:
         rel_file.write("{0}{1}{2}{1}{3}{4}".format(":START_ID", SEP, ":END_ID", ":TYPE", "\n"))
         for pivot_id in relations_map.keys():
             for pivot_data in relations_map[pivot_id]:
                 p_uuid = gen_uuid_for_object(header_map[pivot_id], pivot_data)
                 for row_idx in relations_map[pivot_id][pivot_data]:
+                    edges += len(relations_map[pivot_id][pivot_data][row_idx])
                     for data in relations_map[pivot_id][pivot_data][row_idx]:
                         d_uuid = gen_uuid_for_object(header_map[row_idx], data)
                         rel_file.write('{0}{1}{2}{1}{3}{4}'.format(p_uuid, \
@@ -306,17 +1039,297 @@ def write_obj_rel(header_map, object_map, relations_map, suffix=".csv", folder="
                                                                    d_uuid, \
                                                                    "HAS", \
                                                                    "\n"))
+    count_output(objects, edges, path.join(folder, object_file), \
+                 path.join(folder, out_name(RELATIONS_FILE_PREFIX + SPLITTER + suffix)))
+
+
+def write_obj_rel_compact(header_map, value_tables, edge_map, suffix=".csv", \
+                          folder="./"):
+    '''
+    write_obj_rel_compact writes output of get_objects_and_rel_compact into
+    the same object and relation files as write_obj_rel.
+    '''
+
+    uuids = {}
+    if BINARY_INTERMEDIATE:
+        for i in header_map:
+            uuids[i] = [gen_binary_id(header_map[i], element) for element in value_tables[i]]
+        objects = ((raw_id, header_map[i], element) for i in header_map \
+                   for raw_id, element in zip(uuids[i], value_tables[i]))
+        relations = compact_relations(header_map, value_tables, edge_map, uuids, \
+                                      gen_binary_id)
+        write_obj_rel_binary(objects, relations, suffix, folder)
+        return
+
+    edges_count = 0
+    object_file = out_name(OBJECT_FILE_PREFIX + SPLITTER + suffix)
+    with open_text(path.join(folder, object_file), "w") as obj_file:
+        obj_file.write('{0}{1}{2}{1}{3}{4}'.format(":ID", SEP, "TYPE", "VALUE", "\n"))
+        for i in header_map:
+            uuids[i] = [gen_uuid_for_object(header_map[i], element) \
+                        for element in value_tables[i]]
+            for sha_id, element in zip(uuids[i], value_tables[i]):
+                obj_file.write(sha_id + SEP + str(header_map[i]) + SEP + element + "\n")
+
+    rel_file = out_name(RELATIONS_FILE_PREFIX + SPLITTER + suffix)
+    with open_text(path.join(folder, rel_file), "w") as rel_file:
+        rel_file.write("{0}{1}{2}{1}{3}{4}".format(":START_ID", SEP, ":END_ID", ":TYPE", "\n"))
+        for (pivot_id, row_idx), edges in edge_map.items():
+            if pivot_id not in uuids:
+                uuids[pivot_id] = [gen_uuid_for_object(header_map[pivot_id], element) \
+                                   for element in value_tables[pivot_id]]
+            p_uuids = uuids[pivot_id]
+            d_uuids = uuids[row_idx]
+            edges_count += len(edges)
+            for edge in edges:
+                rel_file.write('{0}{1}{2}{1}{3}{4}'.format(p_uuids[edge >> 32], \
+                                                           SEP, \
+                                                           d_uuids[edge & 0xffffffff], \
+                                                           "HAS", \
+                                                           "\n"))
+    count_output(sum(len(value_tables[i]) for i in header_map), edges_count, \
+                 path.join(folder, object_file), \
+                 path.join(folder, out_name(RELATIONS_FILE_PREFIX + SPLITTER + suffix)))
+
+
+def compact_relations(header_map, value_tables, edge_map, uuids, gen_id):
+    '''
+    compact_relations yields (start id, end id) of every edge of edge_map,
+    uuids holds the ids of value_tables, missing pivot ids are added by gen_id
+    '''
+    for (pivot_id, row_idx), edges in edge_map.items():
+        if pivot_id not in uuids:
+            uuids[pivot_id] = [gen_id(header_map[pivot_id], element) \
+                               for element in value_tables[pivot_id]]
+        p_uuids = uuids[pivot_id]
+        d_uuids = uuids[row_idx]
+        for edge in edges:
+            yield p_uuids[edge >> 32], d_uuids[edge & 0xffffffff]
+
+
+def write_obj_rel_stream(items, suffix=".csv", folder="./"):
+    '''
+    write_obj_rel_stream writes objects and relations from stream_obj_rel into
+    the same files as write_obj_rel while they are produced. Memory does not
+    grow with the input: repeats are skipped only within a bounded set of
+    recently written items, phase2 merge removes the remaining duplicates.
+    '''
+
+    object_file = phase1_name(OBJECT_FILE_PREFIX, suffix)
+    rel_file = phase1_name(RELATIONS_FILE_PREFIX, suffix)
+    seen_objects = set()
+    seen_relations = set()
+    types = {}
+    objects = edges = 0
+    gen_id = gen_binary_id if BINARY_INTERMEDIATE else gen_uuid_for_object
+
+    if BINARY_INTERMEDIATE:
+        obj_file = open_binary(path.join(folder, object_file))
+        rel_file = open_binary(path.join(folder, rel_file))
+    else:
+        obj_file = open_text(path.join(folder, object_file), "w", \
+                             buffering=STREAM_BUFFER_SIZE)
+        rel_file = open_text(path.join(folder, rel_file), "w", buffering=STREAM_BUFFER_SIZE)
+        obj_file.write('{0}{1}{2}{1}{3}{4}'.format(":ID", SEP, "TYPE", "VALUE", "\n"))
+        rel_file.write("{0}{1}{2}{1}{3}{4}".format(":START_ID", SEP, ":END_ID", ":TYPE", "\n"))
+
+    for p_type, p_value, d_type, d_value in items:
+        if d_type is None:
+            key = (p_type, p_value)
+            if key in seen_objects:
+                continue
+            if len(seen_objects) >= STREAM_SEEN_SIZE:
+                seen_objects.clear()
+            seen_objects.add(key)
+            objects += 1
+            if BINARY_INTERMEDIATE:
+                write_binary_object(obj_file, types, gen_binary_id(p_type, p_value), p_type, \
+                                    p_value.encode("utf-8"))
+            else:
+                sha_id = gen_uuid_for_object(p_type, p_value)
+                obj_file.write(sha_id + SEP + str(p_type) + SEP + p_value + "\n")
+            continue
+
+        p_uuid = gen_id(p_type, p_value)
+        d_uuid = gen_id(d_type, d_value)
+        key = (p_uuid, d_uuid)
+        if key in seen_relations:
+            continue
+        if len(seen_relations) >= STREAM_SEEN_SIZE:
+            seen_relations.clear()
+        seen_relations.add(key)
+        edges += 1
+        if BINARY_INTERMEDIATE:
+            rel_file.write(p_uuid + d_uuid)
+        else:
+            rel_file.write('{0}{1}{2}{1}{3}{4}'.format(p_uuid, SEP, d_uuid, "HAS", "\n"))
+
+    if BINARY_INTERMEDIATE:
+        close_binary(obj_file, b"o", types)
+        close_binary(rel_file, b"r")
+    else:
+        obj_file.close()
+        rel_file.close()
+    count_output(objects, edges, path.join(folder, object_file), \
+                 path.join(folder, phase1_name(RELATIONS_FILE_PREFIX, suffix)))
+
+
+def phase1_name(prefix, suffix):
+    ''' phase1_name returns name of phase1 output, .bin with BINARY_INTERMEDIATE '''
+    if BINARY_INTERMEDIATE:
+        return prefix + SPLITTER + suffix + ".bin"
+    return out_name(prefix + SPLITTER + suffix)
+
+
+def id_width(scheme=None):
+    ''' id_width returns bytes of one packed id of scheme (ID_SCHEME) '''
+    scheme = scheme or ID_SCHEME
+    if scheme == "dense":
+        return 8
+    if scheme == "blake2b":
+        return ID_DIGEST_SIZE
+    return hashlib(scheme).digest_size
+
+
+def unpack_uuid(raw, dense):
+    ''' unpack_uuid returns the CSV id of packed id raw '''
+    if dense:
+        return str(int.from_bytes(raw, "little"))
+    return raw.hex()
+
+
+def open_binary(file_name):
+    ''' open_binary creates .bin file_name, its header is written by close_binary '''
+    bin_file = open(file_name, "wb", buffering=STREAM_BUFFER_SIZE)
+    bin_file.write(bytes(BINARY_HEADER.size))
+    return bin_file
+
+
+def write_binary_object(bin_file, types, raw_id, obj_type, value):
+    '''
+    write_binary_object writes object record of packed raw_id, obj_type and
+    utf-8 value bytes. types maps object type to its code in bin_file.
+    '''
+    code = types.get(obj_type)
+    if code is None:
+        code = types[obj_type] = len(types)
+    bin_file.write(raw_id + BINARY_OBJECT.pack(code, len(value)) + value)
+
+
+def close_binary(bin_file, kind, types=None, dense=None, width=None):
+    '''
+    close_binary writes the table of types, the header of kind b"o" (objects)
+    or b"r" (relations) and closes bin_file. Ids are those of ID_SCHEME
+    unless dense and width are given.
+    '''
+
+    if dense is None:
+        dense = ID_SCHEME == "dense"
+    table_offset = bin_file.tell()
+    for obj_type in types or ():
+        name = str(obj_type).encode("utf-8")
+        bin_file.write(BINARY_TYPE.pack(len(name)) + name)
+    bin_file.seek(0)
+    bin_file.write(BINARY_HEADER.pack(BINARY_MAGIC, kind, dense, width or id_width(), \
+                                      table_offset))
+    bin_file.close()
+
+
+def write_obj_rel_binary(objects, relations, suffix=".csv", folder="./"):
+    '''
+    write_obj_rel_binary writes objects (id, type, value) and relations
+    (start id, end id) into .bin files of phase1, see BINARY_INTERMEDIATE.
+    Ids are those of gen_binary_id. Objects are consumed first, so dense ids
+    are numbered as in CSV files.
+    '''
+
+    object_file = path.join(folder, phase1_name(OBJECT_FILE_PREFIX, suffix))
+    rel_file = path.join(folder, phase1_name(RELATIONS_FILE_PREFIX, suffix))
+    types = {}
+    objects_count = edges = 0
+
+    obj_file = open_binary(object_file)
+    for raw_id, obj_type, element in objects:
+        write_binary_object(obj_file, types, raw_id, obj_type, element.encode("utf-8"))
+        objects_count += 1
+    close_binary(obj_file, b"o", types)
+
+    bin_file = open_binary(rel_file)
+    for p_uuid, d_uuid in relations:
+        bin_file.write(p_uuid + d_uuid)
+        edges += 1
+    close_binary(bin_file, b"r")
+    count_output(objects_count, edges, object_file, rel_file)
+
+
+def map_binary(file_name):
+    '''
+    map_binary maps .bin file_name read-only and returns (map, header), header
+    is (kind, dense, width, table offset, list of types by code)
+    '''
+
+    with open(file_name, "rb") as bin_file:
+        data = mmap(bin_file.fileno(), 0, access=ACCESS_READ)
+    magic, kind, dense, width, table_offset = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        data.close()
+        raise ValueError("{} is not a phase1 binary file".format(file_name))
+    types = []
+    offset = table_offset
+    while offset < len(data):
+        length, = BINARY_TYPE.unpack_from(data, offset)
+        offset += BINARY_TYPE.size
+        types.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    return data, (kind, dense, width, table_offset, types)
+
+
+def binary_record(width):
+    ''' binary_record returns Struct of object record head: id of width, BINARY_OBJECT '''
+    return Struct("<{}s{}".format(width, BINARY_OBJECT.format.lstrip("<")))
+
+
+def read_binary_objects(data, header):
+    '''
+    read_binary_objects yields (raw id, type, raw value) of every object of
+    mapped data. Id, type code and value length of a record are unpacked by
+    one Struct call, types are the shared strings of the table.
+    '''
+
+    _, _, width, table_offset, types = header
+    unpack = binary_record(width).unpack_from
+    value_start = width + BINARY_OBJECT.size
+    offset = BINARY_HEADER.size
+    while offset < table_offset:
+        raw_id, code, length = unpack(data, offset)
+        start = offset + value_start
+        yield raw_id, types[code], data[start:start + length]
+        offset = start + length
+
+
+def read_binary_relations(data, header):
+    '''
+    read_binary_relations yields every relation record of mapped data as
+    bytes, unpacked straight from the map
+    '''
+    _, _, width, table_offset, _ = header
+    records = memoryview(data)[BINARY_HEADER.size:table_offset]
+    for record, in Struct("{}s".format(2 * width)).iter_unpack(records):
+        yield record
 
 
 def get_files_prefixes(fs_path="./input", suffix=".csv$"):
     '''
     get_files_prefixes will search in the path and returns all files that
-    contains objects and relations for the graph
+    contains objects and relations for the graph, only .bin files with
+    BINARY_INTERMEDIATE, no .bin files otherwise
     '''
 
     files_prefix = {}
     for _, _, files in walk(fs_path):
         for name in files:
+            if name.endswith(".bin") != BINARY_INTERMEDIATE:
+                continue
             base_name = resub(suffix, '', name)
             name_parts = base_name.split(SPLITTER)
 
@@ -327,18 +1340,33 @@ def get_files_prefixes(fs_path="./input", suffix=".csv$"):
     return files_prefix
 
 
-def merge_files(prefix, files, fs_path, delete_single=True):
+def merge_files(prefix, files, fs_path, delete_single=True, mode=None):
     '''
     merge_files will merge all object files into single object file with
     unique objects. Same is done for relations files.
+    mode "set" keeps every unique line in memory, mode "external" sorts the
+    files in bounded memory (see merge_files_external), mode "parallel"
+    splits the work between processes (see merge_files_parallel). .bin files
+    of BINARY_INTERMEDIATE are merged by merge_files_binary.
     '''
 
+    if BINARY_INTERMEDIATE:
+        merge_files_binary(prefix, files, fs_path, delete_single)
+        return
+
+    if (mode or MERGE_MODE) == "external":
+        merge_files_external(prefix, files, fs_path, delete_single)
+        return
+    if (mode or MERGE_MODE) == "parallel":
+        merge_files_parallel(prefix, files, fs_path, delete_single)
+        return
+
     obj = set()
-    new_name = prefix + SPLITTER + "merged.csv"
-    obj_file = open(path.join(fs_path, new_name), "w")
+    new_name = out_name(prefix + SPLITTER + "merged.csv")
+    obj_file = open_text(path.join(fs_path, new_name), "w")
     for object_file in files:
         my_path = path.join(fs_path, object_file)
-        with open(my_path, "r") as non_merged_file:
+        with open_text(my_path, "r") as non_merged_file:
             for line in non_merged_file:
                 line = line.rstrip()
                 if line != "" and line not in obj:
@@ -347,105 +1375,475 @@ def merge_files(prefix, files, fs_path, delete_single=True):
         if delete_single:
             unlink(my_path)
     obj_file.close()
+    count_output(0, 0, path.join(fs_path, new_name))
 
 
-def run_phase2(fs_path="./input"):
+def spill_sorted_run(lines, fs_path):
+    ''' spill_sorted_run writes sorted unique lines into a temporary run file '''
+    lines.sort()
+    last = None
+    with NamedTemporaryFile(mode="w", prefix="run" + SPLITTER, suffix=".tmp", \
+                            dir=fs_path, delete=False) as run_file:
+        for line in lines:
+            if line != last:
+                run_file.write(line + "\n")
+                last = line
+    return run_file.name
+
+
+def merge_sorted_runs(runs, out_file):
+    '''
+    merge_sorted_runs k-way merges sorted run files into out_file. Duplicates
+    are adjacent after the merge and only the first one is written.
+    '''
+    run_files = [open(run, "r") for run in runs]
+    last = None
+    for line in heapmerge(*run_files):
+        if line != last:
+            out_file.write(line)
+            last = line
+    for run_file in run_files:
+        run_file.close()
+    for run in runs:
+        unlink(run)
+
+
+def merge_files_external(prefix, files, fs_path, delete_single=True, \
+                         memory_budget=None, max_runs=None):
+    '''
+    merge_files_external merges files like merge_files, but with a fixed
+    memory ceiling: lines are collected until memory_budget bytes, sorted and
+    spilled into run files, which are then merged with heapq.merge.
+    The merged file keeps the header first, the rest is sorted and unique.
+    '''
+
+    memory_budget = memory_budget or MERGE_MEMORY_BUDGET
+    max_runs = max_runs or MERGE_MAX_RUNS
+    header = None
+    runs = []
+    lines = []
+    size = 0
+
+    for object_file in files:
+        my_path = path.join(fs_path, object_file)
+        with open_text(my_path, "r") as non_merged_file:
+            first = non_merged_file.readline().rstrip()
+            if header is None:
+                header = first
+            for line in non_merged_file:
+                line = line.rstrip()
+                if line == "":
+                    continue
+                lines.append(line)
+                # str object and list slot overhead on top of the characters
+                size += len(line) + 64
+                if size >= memory_budget:
+                    runs.append(spill_sorted_run(lines, fs_path))
+                    lines = []
+                    size = 0
+        if delete_single:
+            unlink(my_path)
+    if lines:
+        runs.append(spill_sorted_run(lines, fs_path))
+    del lines
+
+    # too many runs to keep open at once are merged in groups first
+    while len(runs) > max_runs:
+        merged_runs = []
+        for i in range(0, len(runs), max_runs):
+            with NamedTemporaryFile(mode="w", prefix="run" + SPLITTER, \
+                                    suffix=".tmp", dir=fs_path, \
+                                    delete=False) as run_file:
+                merge_sorted_runs(runs[i:i + max_runs], run_file)
+            merged_runs.append(run_file.name)
+        runs = merged_runs
+
+    new_name = out_name(prefix + SPLITTER + "merged.csv")
+    with open_text(path.join(fs_path, new_name), "w") as obj_file:
+        if header:
+            obj_file.write(header + "\n")
+        merge_sorted_runs(runs, obj_file)
+    count_output(0, 0, path.join(fs_path, new_name))
+
+
+def scatter_lines(my_path, fs_path, partitions):
+    '''
+    scatter_lines splits lines of my_path (header excluded) into partitions
+    temporary files by crc32 of their id, the first field. Copies of a line
+    always end up in the same partition. Returns the header and the names.
+    '''
+
+    part_files = [NamedTemporaryFile(mode="w", prefix="part" + SPLITTER, suffix=".tmp", \
+                                     dir=fs_path, delete=False) for _ in range(partitions)]
+    writes = [part_file.write for part_file in part_files]
+    with open_text(my_path, "r") as non_merged_file:
+        header = non_merged_file.readline().rstrip()
+        for line in non_merged_file:
+            line = line.rstrip()
+            if line != "":
+                writes[crc32(line.split(SEP, 1)[0].encode("utf-8")) % partitions](line + "\n")
+    for part_file in part_files:
+        part_file.close()
+    return header, [part_file.name for part_file in part_files]
+
+
+def dedup_partition(part_names, fs_path):
+    '''
+    dedup_partition writes unique lines of part_names (one partition of every
+    scattered file) into a temporary file, removes them and returns its name
+    '''
+
+    seen = set()
+    with NamedTemporaryFile(mode="w", prefix="part" + SPLITTER, suffix=".tmp", \
+                            dir=fs_path, delete=False) as out_file:
+        for part_name in part_names:
+            with open(part_name, "r") as part_file:
+                for line in part_file:
+                    if line not in seen:
+                        seen.add(line)
+                        out_file.write(line)
+            unlink(part_name)
+    return out_file.name
+
+
+def merge_files_parallel(prefix, files, fs_path, delete_single=True, partitions=None):
+    '''
+    merge_files_parallel merges files like merge_files on all cores. Every
+    file is scattered into hash partitions by one worker (scatter_lines),
+    then every partition is deduplicated by one worker (dedup_partition),
+    each holding about 1/partitions of the unique lines, and the partitions
+    are concatenated after the header. Lines are grouped by partition, not
+    in the order they were read.
+    '''
+
+    partitions = partitions or MERGE_PARTITIONS or cpu_count()
+    paths = [path.join(fs_path, object_file) for object_file in files]
+    with Pool(processes=min(partitions, cpu_count())) as pool:
+        scattered = pool.starmap(scatter_lines, [(my_path, fs_path, partitions) \
+                                                 for my_path in paths])
+        outputs = pool.starmap(dedup_partition, [([names[part] for _, names in scattered], \
+                                                  fs_path) for part in range(partitions)])
+    if delete_single:
+        for my_path in paths:
+            unlink(my_path)
+
+    new_name = out_name(prefix + SPLITTER + "merged.csv")
+    with open_text(path.join(fs_path, new_name), "w") as obj_file:
+        header = next((header for header, _ in scattered if header), None)
+        if header:
+            obj_file.write(header + "\n")
+        for output in outputs:
+            with open(output, "r") as part_file:
+                copyfileobj(part_file, obj_file)
+            unlink(output)
+    count_output(0, 0, path.join(fs_path, new_name))
+
+
+def merge_binary_objects(data, header, seen, codes, obj_file, bin_file):
+    '''
+    merge_binary_objects writes objects of mapped data whose id is not in
+    seen as CSV lines into obj_file and as records into bin_file. Id, type
+    code and value length of a record are unpacked by one Struct call, only
+    values of new ids are decoded. New records are written into bin_file as
+    runs of the map, those whose type code differs in bin_file (codes) are
+    packed again.
+    '''
+
+    _, dense, width, table_offset, file_types = header
+    view = memoryview(data)
+    unpack = binary_record(width).unpack_from
+    type_cols = [SEP + obj_type + SEP for obj_type in file_types]
+    value_start = width + BINARY_OBJECT.size
+    offset = run_start = BINARY_HEADER.size
+    lines = []
+    while offset < table_offset:
+        raw_id, code, length = unpack(data, offset)
+        end = offset + value_start + length
+        if raw_id in seen:
+            bin_file.write(view[run_start:offset])
+            offset = run_start = end
+            continue
+        seen.add(raw_id)
+        if codes[code] != code:
+            bin_file.write(view[run_start:offset])
+            bin_file.write(raw_id + BINARY_OBJECT.pack(codes[code], length) + \
+                           data[end - length:end])
+            run_start = end
+        lines.append((unpack_uuid(raw_id, dense) + type_cols[code] + \
+                      data[end - length:end].decode("utf-8")).rstrip() + "\n")
+        if len(lines) >= MERGE_BATCH:
+            obj_file.write("".join(lines))
+            lines = []
+        offset = end
+    bin_file.write(view[run_start:offset])
+    obj_file.write("".join(lines))
+
+
+def merge_binary_relations(data, header, seen, obj_file):
+    '''
+    merge_binary_relations writes relations of mapped data not in seen as
+    CSV lines into obj_file. Records are unpacked straight from the map,
+    dense ids as a pair of integers kept in seen as one number.
+    '''
+
+    _, dense, width, table_offset, _ = header
+    records = memoryview(data)[BINARY_HEADER.size:table_offset]
+    lines = []
+    if dense:
+        for start, end in Struct("<QQ").iter_unpack(records):
+            key = start << 64 | end
+            if key in seen:
+                continue
+            seen.add(key)
+            lines.append("{}{}{}{}HAS\n".format(start, SEP, end, SEP))
+            if len(lines) >= MERGE_BATCH:
+                obj_file.write("".join(lines))
+                lines = []
+    else:
+        for record, in Struct("{}s".format(2 * width)).iter_unpack(records):
+            if record in seen:
+                continue
+            seen.add(record)
+            # both hex ids at once, separated after the first one
+            lines.append(record.hex(SEP, width) + SEP + "HAS\n")
+            if len(lines) >= MERGE_BATCH:
+                obj_file.write("".join(lines))
+                lines = []
+    obj_file.write("".join(lines))
+
+
+def merge_files_binary(prefix, files, fs_path, delete_single=True):
+    '''
+    merge_files_binary merges .bin files of phase1 into the same CSV file as
+    merge_files. Objects are unique by id, relations by their record, both
+    compared as packed data of the map and converted to CSV once (see
+    merge_binary_objects and merge_binary_relations). Merged objects are
+    also written into prefix___merged.bin for phase3.
+    '''
+
+    seen = set()
+    types = {}
+    dense = width = None
+    new_name = out_name(prefix + SPLITTER + "merged.csv")
+    bin_name = path.join(fs_path, merge_binary_name(prefix))
+    obj_file = open_text(path.join(fs_path, new_name), "w")
+    bin_file = None
+    if prefix == OBJECT_FILE_PREFIX:
+        bin_file = open_binary(bin_name)
+        obj_file.write('{0}{1}{2}{1}{3}{4}'.format(":ID", SEP, "TYPE", "VALUE", "\n"))
+    else:
+        obj_file.write("{0}{1}{2}{1}{3}{4}".format(":START_ID", SEP, ":END_ID", ":TYPE", "\n"))
+
+    for non_merged in files:
+        my_path = path.join(fs_path, non_merged)
+        data, header = map_binary(my_path)
+        kind, dense, width, _, file_types = header
+        if kind == b"o":
+            # type codes of this file are renumbered to codes of the merged file
+            codes = [types.setdefault(obj_type, len(types)) for obj_type in file_types]
+            merge_binary_objects(data, header, seen, codes, obj_file, bin_file)
+        else:
+            merge_binary_relations(data, header, seen, obj_file)
+        data.close()
+        if delete_single:
+            unlink(my_path)
+    obj_file.close()
+    if bin_file is not None:
+        close_binary(bin_file, b"o", types, dense, width)
+        count_output(0, 0, bin_name)
+    count_output(0, 0, path.join(fs_path, new_name))
+
+
+def merge_binary_name(prefix):
+    ''' merge_binary_name returns name of merged .bin file of merge_files_binary '''
+    return prefix + SPLITTER + "merged.bin"
+
+
+def run_phase2(fs_path="./input", mode=None):
     '''
     run_phase2 is a skeleton call to search for object and relations
     files and each of them is merged. each csv_file from phase1 will have 1
     object file and 1 relations file. phase2 will merge all objects together
     to create just 1 object file in total. same happens with relations file.
+    mode is passed to merge_files, MERGE_MODE is used by default.
     '''
 
     files_prefix = get_files_prefixes(fs_path)
     for graph_files in files_prefix:
-        merge_files(graph_files, files_prefix[graph_files], fs_path)
+        merge_files(graph_files, files_prefix[graph_files], fs_path, mode=mode)
 
 
 def run_phase3(fs_path="./input"):
     '''
     run_phase3 is a skeleton call to search for object files and
-    to connect_pivots
+    to connect_pivots. With BINARY_INTERMEDIATE the merged .bin file of phase2
+    is removed afterwards, the CSV files are the output.
     '''
 
     files_prefix = get_files_prefixes(fs_path)
     if OBJECT_FILE_PREFIX in files_prefix.keys():
         connect_pivots(PIVOT_FILE_PREFIX, files_prefix[OBJECT_FILE_PREFIX], fs_path)
+        if BINARY_INTERMEDIATE:
+            for name in files_prefix[OBJECT_FILE_PREFIX]:
+                unlink(path.join(fs_path, name))
 
 
-def connect_pivots(prefix, files, fs_path, suffix=".csv"):
+def read_objects(my_path, skip_header=True):
+    '''
+    read_objects yields (id, type, value) of every object line in my_path,
+    or of every object of a .bin file of BINARY_INTERMEDIATE
+    '''
+    if my_path.endswith(".bin"):
+        data, header = map_binary(my_path)
+        dense = header[1]
+        for raw_id, obj_type, value in read_binary_objects(data, header):
+            yield [unpack_uuid(raw_id, dense), obj_type, value.decode("utf-8").rstrip()]
+        data.close()
+        return
+    with open_text(my_path, "r") as object_file:
+        if skip_header:
+            object_file.readline()
+        for line in object_file:
+            line = line.rstrip()
+            yield line.split(SEP)
+
+
+def index_by_value(objects, index=None):
+    '''
+    index_by_value groups objects by VALUE: value -> set of (type, id).
+    Duplicate object lines end up as one entry.
+    '''
+    if index is None:
+        index = {}
+    for obj_id, obj_type, obj_value in objects:
+        if obj_value not in index:
+            index[obj_value] = set()
+        index[obj_value].add((obj_type, obj_id))
+    return index
+
+
+def write_value_groups(index, pivot_file):
+    '''
+    write_value_groups writes RELATES relations within each value group of
+    the index and returns their count. Objects of the same type are not
+    related, each relation goes from the greater type to the lesser one.
+    '''
+    count = 0
+    for objects in index.values():
+        if len(objects) < 2:
+            continue
+        ids_by_type = {}
+        for obj_type, obj_id in objects:
+            if obj_type not in ids_by_type:
+                ids_by_type[obj_type] = []
+            ids_by_type[obj_type].append(obj_id)
+
+        types = sorted(ids_by_type)
+        for type_idx, from_type in enumerate(types):
+            for to_type in types[:type_idx]:
+                for p_from in ids_by_type[from_type]:
+                    for p_to in ids_by_type[to_type]:
+                        pivot_file.write('{0}{1}{2}{1}{3}{4}'.format(p_from, SEP, \
+                                                                     p_to, \
+                                                                     'RELATES', \
+                                                                     '\n'))
+                        count += 1
+    return count
+
+
+def connect_pivots(prefix, files, fs_path, suffix=".csv", index_budget=None):
     '''
     connect_pivots will connect objects having same value but different type (
     different csv header). If this func is called after run_phase2,
     there should be just one object file in files argument.
+    Objects are grouped by value in a hash index and related only within
+    their group. When the object files are larger than index_budget bytes,
+    objects are first split into partitions by a hash of the value and each
+    partition is indexed on its own.
     '''
 
-    obj = set()
-
-    # find if any object of different type has the same value and join
-    for object_file in files:
-        my_path = path.join(fs_path, object_file)
-        pivot_file = open(my_path, 'r')
-        pivot_line_reads = 0
-        for pivot_line in pivot_file:
-            pivot_line_reads += 1
-            # skip header
-            if pivot_line_reads == 1:
-                continue
-
-            pivot_line = pivot_line.rstrip()
-            pivot_id, pivot_type, pivot_value = pivot_line.split(SEP)
-
-            for rel_file in files:
-                rel_path = path.join(fs_path, rel_file)
-                rel_line_reads = 0
-                with open(rel_path, "r") as my_file:
-                    for line in my_file:
-                        rel_line_reads += 1
-                        if rel_line_reads == 1:
-                            continue
-
-                        line = line.rstrip()
-                        new_id, new_type, new_value = line.split(SEP)
-
-                        if new_id == pivot_id or new_type == pivot_type:
-                            continue
-
-                        if new_value == pivot_value:
-                            if pivot_type > new_type:
-                                rel = pivot_id + SPLITTER + new_id
-                            else:
-                                rel = new_id + SPLITTER + pivot_id
-                            if rel not in obj:
-                                obj.add(rel)
-
-        pivot_file.close()
-
-    if obj:
-        name = prefix + suffix
-        pivot_file = open(path.join(fs_path, name), "w")
-        pivot_file.write(":START_ID,:END_ID,:TYPE\n")
-
-        for rel in obj:
-            p_from, p_to = rel.split(SPLITTER)
-            data = '{0}{1}{2}{1}{3}{4}'.format(p_from, SEP, p_to, 'RELATES', '\n')
-            pivot_file.write(data)
-
-        pivot_file.close()
+    index_budget = index_budget or CONNECT_INDEX_BUDGET
+    paths = [path.join(fs_path, object_file) for object_file in files]
+    # compressed object files are assumed to be a fifth of their text
+    partitions = sum(path.getsize(my_path) * (5 if my_path.endswith(".gz") else 1) \
+                     for my_path in paths) // index_budget + 1
+
+    name = out_name(prefix + suffix)
+    pivot_file = open_text(path.join(fs_path, name), "w")
+    pivot_file.write(":START_ID,:END_ID,:TYPE\n")
+    count = 0
+
+    if partitions == 1:
+        index = {}
+        for my_path in paths:
+            index_by_value(read_objects(my_path), index)
+        count += write_value_groups(index, pivot_file)
+    else:
+        part_files = [NamedTemporaryFile(mode="w", prefix="part" + SPLITTER, \
+                                         suffix=".tmp", dir=fs_path, delete=False) \
+                      for _ in range(partitions)]
+        for my_path in paths:
+            for obj in read_objects(my_path):
+                part = crc32(obj[2].encode("utf-8")) % partitions
+                part_files[part].write(SEP.join(obj) + "\n")
+        for part_file in part_files:
+            part_file.close()
+            index = index_by_value(read_objects(part_file.name, skip_header=False))
+            count += write_value_groups(index, pivot_file)
+            unlink(part_file.name)
+
+    pivot_file.close()
+    count_output(0, count, path.join(fs_path, name))
+    if not count:
+        unlink(path.join(fs_path, name))
 
 
 def process_csv_file(csv_file="2007.csv", pivots=["FlightNum"], whitelist=['*'], \
-                     autopivot=True):
+                     autopivot=True, delim=",", parallel=False):
     '''
     process_csv_file will generate object and relation files from CSV
-    and writes them to disk
+    and writes them to disk. parallel splits the CSV between all cores
+    (see get_objects_and_rel_parallel). STREAM_OUTPUT writes it while
+    reading (see write_obj_rel_stream) and COMPACT_MAPS parses it into
+    compact maps (see get_objects_and_rel_compact), both in one process
+    even if parallel is set.
     '''
 
+    if STREAM_OUTPUT:
+        if parallel:
+            log_me("Phase1: {} parsed by one process, STREAM_OUTPUT overrides " \
+                   "parallel parse".format(csv_file))
+        _, pivot_idx = get_pivots(csv_file=csv_file, pivots=pivots, delim=delim, \
+                                  whitelist=whitelist, autopivot=autopivot)
+        rows = stream_csv_rows(csv_file, delim=delim)
+        write_obj_rel_stream(stream_obj_rel(rows, pivot_idx, whitelist=whitelist), \
+                             suffix=csv_file, folder="./input")
+        return
+
+    if COMPACT_MAPS:
+        if parallel:
+            log_me("Phase1: {} parsed by one process, COMPACT_MAPS overrides " \
+                   "parallel parse".format(csv_file))
+        header_map, value_tables, edge_map = \
+            get_objects_and_rel_compact(csv_file=csv_file, \
+                                        pivots=pivots, \
+                                        delim=delim, \
+                                        whitelist=whitelist, \
+                                        autopivot=autopivot)
+        write_obj_rel_compact(header_map, value_tables, edge_map, suffix=csv_file, \
+                              folder="./input")
+        return
+
+    if parallel:
+        get_objects_and_rel = get_objects_and_rel_parallel
+    else:
+        get_objects_and_rel = get_objects_and_rel_from_csv
     header_map, object_map, relations_map = \
-        get_objects_and_rel_from_csv(csv_file=csv_file, \
-                                     pivots=pivots, \
-                                     whitelist=whitelist, \
-                                     autopivot=autopivot)
+        get_objects_and_rel(csv_file=csv_file, \
+                            pivots=pivots, \
+                            delim=delim, \
+                            whitelist=whitelist, \
+                            autopivot=autopivot)
     write_obj_rel(header_map, object_map, relations_map, suffix=csv_file, \
                   folder="./input")
 
@@ -453,52 +1851,329 @@ def process_csv_file(csv_file="2007.csv", pivots=["FlightNum"], whitelist=['*'],
         print_obj_rel(header_map, object_map, relations_map)
 
 
-def run_phase1():
+def load_phase1_manifest(manifest_file):
+    '''
+    load_phase1_manifest reads phase1 jobs from a JSON manifest, a list of
+    {"csv": file, "pivots": [...], "whitelist": [...], "autopivot": bool,
+     "delim": ","}
+    '''
+
+    with open(manifest_file) as my_file:
+        entries = json_load(my_file)
+    return [(entry["csv"], entry.get("pivots", []), entry.get("whitelist", ['*']), \
+             entry.get("autopivot", False), entry.get("delim", ",")) for entry in entries]
+
+
+def get_job_size(job):
+    ''' get_job_size returns csv size of phase1 job, 0 if there is no file '''
+    return path.getsize(job[0]) if path.isfile(job[0]) else 0
+
+
+def run_phase1_job(job, parallel=False):
+    '''
+    run_phase1_job runs process_csv_file for one phase1 job and returns its
+    report: csv, size, ok, error and duration in seconds. With STATS on, the
+    report has pid and counters of the job (see get_stats) and progress is
+    printed while it runs. PROFILE_DIR gets a cProfile dump of the job.
+    '''
+
+    start = time()
+    report = {"csv": job[0], "size": get_job_size(job), "ok": True, "error": None}
+    if STATS:
+        before = get_stats()
+        stop = start_progress(job[0], start)
+    profile = Profile() if PROFILE_DIR else None
+    try:
+        if profile:
+            profile.runcall(process_csv_file, *job, parallel=parallel)
+        else:
+            process_csv_file(*job, parallel=parallel)
+    except Exception as err:
+        report["ok"] = False
+        report["error"] = "{}: {}".format(type(err).__name__, err)
+    report["duration"] = time() - start
+    if profile:
+        profile.dump_stats(path.join(PROFILE_DIR, "phase1" + SPLITTER + \
+                                     path.basename(job[0]) + ".prof"))
+    if STATS:
+        stop.set()
+        report["pid"] = getpid()
+        report["stats"] = diff_stats(before, get_stats())
+    log_phase1_report(report)
+    return report
+
+
+def log_phase1_report(report):
+    ''' log_phase1_report prints the outcome of one phase1 job '''
+    log_me("Phase1: {}, size: {}, {} in {:.2f}s{}".format( \
+        report["csv"], report["size"], "ok" if report["ok"] else "FAILED", \
+        report["duration"], ", " + report["error"] if report["error"] else ""))
+
+
+def run_phase1(jobs=None, memory_budget=None, on_report=None):
     '''
     run_phase1 parses csv files concurently and generates object and relations
     files from each csv file. For each csv file, define list of pivots (column
     names), list of whitelisted columns (useful if CSV has 100+ fields),
     and autopivot. If it is True, list of pivots is ignored.
+    jobs is a list of such (csv, pivots, whitelist, autopivot[, delim])
+    tuples, PHASE1_JOBS by default (see load_phase1_manifest).
+    Jobs are started largest first while their estimated memory fits into
+    memory_budget (PHASE1_MEMORY_BUDGET). With PARALLEL_PARSE, files from
+    PARALLEL_MIN_SIZE bytes are parsed first, one at a time, each one split
+    between all cores.
+    Returns list of job reports, failures are reported and do not stop others.
+    on_report is called with each report as soon as its job finishes.
+    '''
+
+    jobs = sorted(PHASE1_JOBS if jobs is None else jobs, key=get_job_size, reverse=True)
+    memory_budget = memory_budget or PHASE1_MEMORY_BUDGET
+    started = time()
+    reports = []
+
+    # streams and compact maps are built by one process, large files are
+    # scheduled too
+    parallel = PARALLEL_PARSE and not STREAM_OUTPUT and not COMPACT_MAPS
+    if PARALLEL_PARSE and not parallel:
+        log_me("Phase1: PARALLEL_PARSE ignored, {} parses each file in one " \
+               "process".format("STREAM_OUTPUT" if STREAM_OUTPUT else "COMPACT_MAPS"))
+
+    def finish(report):
+        reports.append(report)
+        if on_report:
+            on_report(report)
+
+    small_jobs = []
+    for job in jobs:
+        if parallel and get_job_size(job) >= PARALLEL_MIN_SIZE:
+            finish(run_phase1_job(job, parallel=True))
+        else:
+            small_jobs.append(job)
+
+    # dense ids come from one interning table, all files in this process
+    if ID_SCHEME == "dense":
+        for job in small_jobs:
+            finish(run_phase1_job(job))
+    elif small_jobs:
+        schedule_phase1(small_jobs, max(cpu_count() - 1, 1), memory_budget, finish)
+
+    if STATS:
+        add_worker_stats(reports)
+        STATS_REPORT["workers"].extend(reports)
+    failed = [report["csv"] for report in reports if not report["ok"]]
+    log_me("Phase1: {} jobs, {} failed {}, work {:.2f}s, wall {:.2f}s".format( \
+        len(reports), len(failed), failed, \
+        sum(report["duration"] for report in reports), time() - started))
+    return reports
+
+
+def schedule_phase1(jobs, processes, memory_budget, on_report=None):
     '''
+    schedule_phase1 runs jobs (sorted largest first) in a pool of processes.
+    Whenever a worker is free, the largest pending job whose memory estimate
+    fits next to the running jobs is started. A job larger than the whole
+    budget runs alone. on_report is called with each report as it arrives.
+    '''
+
+    pending = list(jobs)
+    done = Queue()
+    reports = []
+    running = 0
+    memory = 0
+
+    with Pool(processes=processes) as pool:
+        while pending or running:
+            for job in list(pending):
+                if running >= processes:
+                    break
+                estimate = get_job_size(job) * PHASE1_MEMORY_FACTOR
+                if running and memory + estimate > memory_budget:
+                    continue
+                pending.remove(job)
+                running += 1
+                memory += estimate
+                pool.apply_async(run_phase1_job, args=(job,), callback=done.put, \
+                    error_callback=lambda err, job=job: done.put( \
+                        {"csv": job[0], "size": get_job_size(job), "ok": False, \
+                         "error": "{}: {}".format(type(err).__name__, err), \
+                         "duration": 0.0}))
+
+            report = done.get()
+            running -= 1
+            memory -= report["size"] * PHASE1_MEMORY_FACTOR
+            reports.append(report)
+            if on_report:
+                on_report(report)
+
+    return reports
+
+
+def get_file_hash(file_name, old_entry=None):
+    '''
+    get_file_hash returns sha1 of file_name content, its size and mtime.
+    Hash of old_entry is reused if the size and mtime did not change.
+    '''
+
+    file_stat = stat(file_name)
+    if old_entry and old_entry["size"] == file_stat.st_size \
+        and old_entry["mtime"] == file_stat.st_mtime:
+        return old_entry["hash"], file_stat.st_size, file_stat.st_mtime
+
+    my_hash = hashlib("sha1")
+    with open(file_name, "rb") as my_file:
+        for block in iter(lambda: my_file.read(1024 * 1024), b""):
+            my_hash.update(block)
+    return my_hash.hexdigest(), file_stat.st_size, file_stat.st_mtime
+
+
+def get_job_params(job):
+    ''' get_job_params returns all settings that change phase1 job outputs '''
+    params = {"pivots": list(job[1]), "whitelist": list(job[2]), "autopivot": job[3], \
+              "delim": job[4] if len(job) > 4 else ",", \
+              "id_scheme": ID_SCHEME, "id_digest_size": ID_DIGEST_SIZE}
+    # outputs of both formats are not interchangeable, older states have no key
+    if BINARY_INTERMEDIATE:
+        params["binary"] = True
+    return params
+
+
+def load_state(fs_path="./input"):
+    ''' load_state returns incremental state saved in fs_path, or empty one '''
+    state_path = path.join(fs_path, STATE_FILE)
+    if not path.isfile(state_path):
+        return {"phase1": {}}
+    with open(state_path) as state_file:
+        return json_load(state_file)
+
 
-    if cpu_count() <= 1:
-        pool = Pool(processes=1)
+def save_state(state, fs_path="./input"):
+    ''' save_state writes incremental state, replacing the old one at once '''
+    state_path = path.join(fs_path, STATE_FILE)
+    with open(state_path + ".tmp", "w") as state_file:
+        json_dump(state, state_file, indent=1, sort_keys=True)
+    replace(state_path + ".tmp", state_path)
+
+
+def run_incremental(jobs=None, fs_path="./input"):
+    '''
+    run_incremental runs the 3 phases, but reuses work of previous runs.
+    Phase1 outputs are kept, each one recorded in STATE_FILE with content
+    hash and parameters of its csv. A csv with the same hash and parameters
+    is not parsed again, outputs of csv files no longer in jobs are removed.
+    Each parsed csv is recorded as soon as its job finishes, so an
+    interrupted phase1 does not parse it again. Phase2 and phase3 run only
+    when the set of phase1 outputs changed since they last completed, so an
+    interrupted run resumes at the phase that did not finish. Phase1 writes
+    into ./input, fs_path should match it.
+    '''
+
+    jobs = PHASE1_JOBS if jobs is None else jobs
+    state = load_state(fs_path)
+    done = state["phase1"]
+    entries = {}
+    todo = []
+
+    for job in jobs:
+        csv_file = job[0]
+        if not path.isfile(csv_file):
+            # let phase1 report it
+            todo.append(job)
+            continue
+        old_entry = done.get(csv_file)
+        my_hash, size, mtime = get_file_hash(csv_file, old_entry)
+        entry = {"hash": my_hash, "size": size, "mtime": mtime, \
+                 "params": get_job_params(job), \
+                 "outputs": [phase1_name(OBJECT_FILE_PREFIX, csv_file), \
+                             phase1_name(RELATIONS_FILE_PREFIX, csv_file)]}
+        # dense ids are numbered anew every run, old outputs do not match
+        if ID_SCHEME != "dense" and old_entry \
+            and old_entry["hash"] == my_hash \
+            and old_entry["params"] == entry["params"] \
+            and all(path.isfile(path.join(fs_path, name)) for name in entry["outputs"]):
+            log_me("Incremental: {} unchanged, skipped".format(csv_file))
+            continue
+        entries[csv_file] = entry
+        todo.append(job)
+
+    removed = set(done) - set(job[0] for job in jobs)
+    for csv_file in removed:
+        for name in done.pop(csv_file)["outputs"]:
+            if path.isfile(path.join(fs_path, name)):
+                unlink(path.join(fs_path, name))
+
+    # every finished job is recorded at once, an interrupted run keeps them
+    def record(report):
+        if report["ok"] and report["csv"] in entries:
+            done[report["csv"]] = entries[report["csv"]]
+        else:
+            done.pop(report["csv"], None)
+        save_state(state, fs_path)
+
+    # phase2 and phase3 outputs of the old phase1 outputs are stale from now
+    # on, even if the parse fails or is interrupted
+    if todo or removed:
+        state.pop("phase2", None)
+        state.pop("phase3", None)
+        save_state(state, fs_path)
+    if todo:
+        run_phase1(todo, on_report=record)
+    save_state(state, fs_path)
+
+    # phase2 and phase3 outputs are valid for this set of phase1 outputs
+    digest = algo_get_hash(json_dumps(sorted((csv_file, entry["hash"], entry["params"]) \
+                                             for csv_file, entry in done.items()), \
+                                      sort_keys=True))
+    merged = [out_name(prefix + SPLITTER + "merged.csv") \
+              for prefix in (OBJECT_FILE_PREFIX, RELATIONS_FILE_PREFIX)]
+    # phase3 reads the merged .bin objects of merge_files_binary
+    pivot_input = merged[0]
+    if BINARY_INTERMEDIATE:
+        pivot_input = merge_binary_name(OBJECT_FILE_PREFIX)
+        merged.append(pivot_input)
+
+    if state.get("phase2") != digest \
+        or not all(path.isfile(path.join(fs_path, name)) for name in merged):
+        for idx, prefix in enumerate((OBJECT_FILE_PREFIX, RELATIONS_FILE_PREFIX)):
+            merge_files(prefix, [entry["outputs"][idx] for entry in done.values()], \
+                        fs_path, delete_single=False)
+        state["phase2"] = digest
+        state.pop("phase3", None)
+        save_state(state, fs_path)
     else:
-        pool = Pool(processes=cpu_count()-1)
-
-    pool.apply_async(process_csv_file, \
-        args=("2007-30.csv", \
-              ['whatever_since_autopivot_is_true'], \
-              ['*'], \
-              True))
-    #pool.apply_async(process_csv_file, \
-    #    args=("2007.csv", \
-    #          ['whatever_since_autopivot_is_true'], \
-    #          ['*'], \
-    #          True))
-    pool.apply_async(process_csv_file, \
-        args=("a.csv", \
-        ['whatever_since_autopivot_is_true'], \
-        ['*'], \
-        True))
-    pool.close()
-    pool.join()
-
-
-def main():
+        log_me("Incremental: phase2 outputs up to date")
+
+    if state.get("phase3") != digest:
+        connect_pivots(PIVOT_FILE_PREFIX, [pivot_input], fs_path)
+        state["phase3"] = digest
+        save_state(state, fs_path)
+    else:
+        log_me("Incremental: phase3 outputs up to date")
+
+
+def main(incremental=None):
     '''
     main starts the show. there are 3 phases to generate vertices (objects) and
     edges (relations) for the graph (can be imported into neo4j)
+    incremental (INCREMENTAL by default) skips work done by previous runs.
+    STATS saves per phase and per job counters into STATS_FILE.
     '''
 
-    # generate objects and relations
-    run_phase1()
+    if incremental is None:
+        incremental = INCREMENTAL
+    if incremental:
+        timed_phase("incremental", run_incremental, fs_path="./input")
+    else:
+        # generate objects and relations
+        timed_phase("phase1", run_phase1)
+
+        # merge objects and relations
+        timed_phase("phase2", run_phase2, fs_path="./input")
 
-    # merge objects and relations
-    run_phase2(fs_path="./input")
+        # connect objects of different types with same value
+        timed_phase("phase3", run_phase3, fs_path="./input")
 
-    # connect objects of different types with same value
-    run_phase3(fs_path="./input")
+    if STATS:
+        save_stats()
 
 
 if __name__ == "__main__":
@@ -1,36 +1,63 @@
 #!/usr/bin/env python
 
-import os
+from __future__ import print_function
+
 from multiprocessing import cpu_count, Pool
 
-def generate_ipv4(low_range,high_range):
-    f = open('file-' + str(low_range) + '_' + str(high_range) + ".csv", "a")    
+# every /16 block is formatted as one string from these tables: "c.d," of all
+# 65536 hosts of a /16 joined with the "a.b." prefix, then every ip_num is
+# filled in by a single % over the block range
+octets = [str(i) for i in range(256)]
+host_tails = [octets[c] + '.' + octets[d] + ',' for c in range(256) for d in range(256)]
+# /16 blocks (~1.6 MB each) collected for one writelines call
+blocks_per_write = 16
+write_buffer = 1 << 24
+
+
+def format_block(block):
+    # rows of the /16 block number block (ip >> 16)
+    prefix = octets[block >> 8] + '.' + octets[block & 255] + '.'
+    base = block << 16
+    template = prefix + ('%d\n' + prefix).join(host_tails) + '%d\n'
+    return template % tuple(range(base, base + 65536))
+
+
+def generate_ipv4(low_block, high_block):
+    # all addresses of /16 blocks [low_block, high_block)
+    name = 'file-%s_%s.csv' % (block_name(low_block), block_name(high_block))
+    f = open(name, "w", write_buffer)
     f.write('ip_addr:ID,ip_num' + "\n")
-    for a in range(low_range,high_range):
-        for b in range (0,256):
-            for c in range(0,256):
-                for d in range(0,256):
-                    ip_addr = "%s.%s.%s.%s" % (a, b, c, d)
-                    ip_num = a*256**3 + b*256**2 + c*256 + d
-                    f.write(ip_addr + "," + str(ip_num) + "\n")
+    for start in range(low_block, high_block, blocks_per_write):
+        end = min(start + blocks_per_write, high_block)
+        f.writelines([format_block(block) for block in range(start, end)])
     f.close()
 
-num_of_processes = cpu_count()-1
-chunk_factor = 1
-pool = Pool(processes=num_of_processes)
-print pool
 
-left = 256
-step = left / (num_of_processes * chunk_factor)
-while left > step:
-    high = left
-    left -= step
-    low = left
-    pool.apply_async(generate_ipv4, args=(low, high))
-else:
-    pool.apply_async(generate_ipv4, args=(0, left))
+def block_name(block):
+    # "a.b" of a /16 block, "256.0" is the end of the address space
+    return '%d.%d' % (block >> 8, block & 255)
+
+
+def split_blocks(tasks, blocks=65536):
+    # tasks contiguous ranges of /16 blocks, sizes differ by one at most
+    bounds = [i * blocks // tasks for i in range(tasks + 1)]
+    return [(low, high) for low, high in zip(bounds, bounds[1:]) if low < high]
+
+
+def main():
+    num_of_processes = max(cpu_count() - 1, 1)
+    chunk_factor = 1
+    tasks = split_blocks(num_of_processes * chunk_factor)
+
+    pool = Pool(processes=num_of_processes)
+    print("generating %d addresses in %d files on %d processes" %
+          (1 << 32, len(tasks), num_of_processes))
+    for low, high in tasks:
+        pool.apply_async(generate_ipv4, args=(low, high))
 
-pool.close()
-pool.join()
+    pool.close()
+    pool.join()
 
 
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,105 @@
 #!/usr/bin/env python
 
-import os, random
+from __future__ import print_function
+
+import fcntl, heapq, mmap, os, random, tempfile, time
 from multiprocessing import cpu_count, Pool
 
 total_loops = 100000
 step = 5000
 subnets = [23, 24, 25, 26, 27, 28, 29]
 
+# dedup store kept between runs under spool_dir:
+#   ipaddresses.bitmap  one bit per ipv4 address (512 MB sparse file), set by
+#                       every worker through a shared mmap
+#   subnets/run-*       append-only sorted runs of subnet ids, one per task.
+#                       relationships are not stored, they follow from the
+#                       subnet and are expanded once per unique subnet
+spool_dir = "./spool"
+bitmap_size = 1 << 29
+# most runs merged in one pass, more runs are first merged in groups
+max_runs = 128
+scan_chunk = 1 << 20
+
+# set bit positions of every byte value, lowest bit first
+bit_positions = [[i for i in range(8) if byte >> i & 1] for byte in range(256)]
+
+
 def format_binary(num):
     return format(num, '08b')
 
 
 def int2ip(i):
     d = i % 256
-    i = i / 256
+    i = i // 256
     c = i % 256
-    i = i / 256
+    i = i // 256
     b = i % 256
-    a = i / 256
+    a = i // 256
     return "%s.%s.%s.%s" % (a, b, c, d)
 
-def write_file(file_path):
+
+def open_bitmap(spool):
+    # shared writable mapping of the ip bitmap, created sparse on first use
+    f = open(os.path.join(spool, 'ipaddresses.bitmap'), 'a+b')
+    if os.fstat(f.fileno()).st_size < bitmap_size:
+        f.truncate(bitmap_size)
+    return f, mmap.mmap(f.fileno(), bitmap_size)
+
+
+def mark_range(f, bits, low, high):
+    # sets bits of [low, high). the partial bytes at the edges are or-ed
+    # under a lock of that byte, the whole bytes are assigned under a lock of
+    # their range: another worker may be or-ing the edge byte of its own
+    # subnet in there, an unlocked assignment would be lost to its write back
+    first, last = low >> 3, high >> 3
+    if first == last:
+        mark_byte(f, bits, first, (0xff << (low & 7)) & ((1 << (high & 7)) - 1))
+        return
+    if low & 7:
+        mark_byte(f, bits, first, (0xff << (low & 7)) & 0xff)
+        first += 1
+    if first < last:
+        fcntl.lockf(f, fcntl.LOCK_EX, last - first, first)
+        try:
+            bits[first:last] = b'\xff' * (last - first)
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN, last - first, first)
+    if high & 7:
+        mark_byte(f, bits, last, (1 << (high & 7)) - 1)
+
+
+def mark_byte(f, bits, offset, value):
+    fcntl.lockf(f, fcntl.LOCK_EX, 1, offset)
     try:
-        open(file_path, "r").close()
-    except IOError:
-        open(file_path, "w").close()
-    
-def generate_subnets(loop, *argv):
-
-    #fsub = open('subnets-' + str(loop) + ".csv", "w")
-    #fsub.write('subnetID:ID\n')
-    #frel = open('relationships-' + str(loop) + ".csv", "w")    
-    #frel.write(":START_ID,:END_ID,:TYPE\n")
-    #fip = open('ipaddresses-' + str(loop) + ".csv", "a")
-#    fip.write('ip_addr:ID,ip_num\n')
-    #ip_list = []
+        value |= bytearray(bits[offset:offset + 1])[0]
+        bits[offset:offset + 1] = bytes(bytearray([value]))
+    finally:
+        fcntl.lockf(f, fcntl.LOCK_UN, 1, offset)
+
+
+def write_run(run_dir, lines):
+    # a sorted, deduplicated run file, renamed into place once complete so
+    # readers never see a partial run
+    lines.sort()
+    fd, tmp = tempfile.mkstemp(prefix='tmp-', dir=run_dir)
+    f = os.fdopen(fd, 'w')
+    last = None
+    for line in lines:
+        if line != last:
+            f.write(line)
+            last = line
+    f.close()
+    name = os.path.join(run_dir, 'run-%d-%d-%s' % (os.getpid(), int(time.time() * 1e6),
+                                                   os.path.basename(tmp)[4:]))
+    os.rename(tmp, name)
+    return name
+
+
+def generate_subnets(loop, spool=spool_dir):
+
+    f, bits = open_bitmap(spool)
+    subnet_ids = []
 
     while loop > 0 :
         loop -= 1
@@ -51,55 +116,137 @@ def generate_subnets(loop, *argv):
         broadcast_mask = int('0' * mask + '1' * wildcard, 2)
         low_ip_int = ip_int & network_mask
         high_ip_int = ip_int | broadcast_mask
-    
+
         ip = "%s.%s.%s.%s" % (a, b, c, d)
-        network_str = ip + "_" + str(mask)
-        #fsub.write(network_str + '\n')
-        write_file("./subnets/" + network_str)
-    
-        for num in range(low_ip_int, high_ip_int):
-            write_file("./ipaddresses/" + str(num))
-            write_file("./relationships/" + network_str + ',' + int2ip(num) + ',' + 'INCLUDES')
-    
+        network_str = ip + "/" + str(mask)
+        subnet_ids.append(network_str + '\n')
+        mark_range(f, bits, low_ip_int, high_ip_int)
+
+    bits.close()
+    f.close()
+    write_run(os.path.join(spool, 'subnets'), subnet_ids)
+
+
+def list_runs(run_dir):
+    return sorted(os.path.join(run_dir, name) for name in os.listdir(run_dir)
+                  if name.startswith('run-'))
+
+
+def merge_runs(runs, out, on_line=None):
+    # k-way merge of sorted runs into out, duplicates end up adjacent and
+    # are dropped. on_line is called with every unique line
+    files = [open(run, "r") for run in runs]
+    last = None
+    for line in heapq.merge(*files):
+        if line != last:
+            out.write(line)
+            if on_line is not None:
+                on_line(line)
+            last = line
+    for f in files:
+        f.close()
+
+
+def compact_runs(run_dir):
+    # merges all runs into one, in groups of max_runs, and removes the
+    # merged ones. returns the remaining run
+    runs = list_runs(run_dir)
+    while len(runs) > 1:
+        merged = []
+        for i in range(0, len(runs), max_runs):
+            group = runs[i:i + max_runs]
+            if len(group) == 1:
+                merged.extend(group)
+                continue
+            fd, tmp = tempfile.mkstemp(prefix='tmp-', dir=run_dir)
+            f = os.fdopen(fd, 'w')
+            merge_runs(group, f)
+            f.close()
+            name = os.path.join(run_dir, 'run-%d-%d-%s' % (
+                os.getpid(), int(time.time() * 1e6), os.path.basename(tmp)[4:]))
+            os.rename(tmp, name)
+            for run in group:
+                os.unlink(run)
+            merged.append(name)
+        runs = merged
+    return runs[0] if runs else None
+
+
+def write_relationships(frel, network_str):
+    ip, mask = network_str.split('/')
+    a, b, c, d = [int(octet) for octet in ip.split('.')]
+    ip_int = a << 24 | b << 16 | c << 8 | d
+    broadcast_mask = (1 << (32 - int(mask))) - 1
+    low_ip_int = ip_int & ~broadcast_mask
+    high_ip_int = ip_int | broadcast_mask
+    head = '"' + network_str + '","'
+    frel.write(''.join([head + int2ip(num) + '",INCLUDES\n'
+                        for num in range(low_ip_int, high_ip_int)]))
+
+
+def write_ipaddresses(fip, bits):
+    # ip addresses in ascending order, empty regions of the bitmap are
+    # skipped in bulk
+    empty_chunk = b'\0' * scan_chunk
+    for offset in range(0, bitmap_size, scan_chunk):
+        chunk = bits[offset:offset + scan_chunk]
+        if chunk == empty_chunk:
+            continue
+        chunk = bytearray(chunk)
+        rows = []
+        for i, byte in enumerate(chunk):
+            if byte:
+                base = (offset + i) << 3
+                rows.extend([int2ip(base + bit) + ',' + str(base + bit) + '\n'
+                             for bit in bit_positions[byte]])
+        fip.write(''.join(rows))
+
+
+def merge_store(spool=spool_dir):
+    # writes subnets.csv, relationships.csv and ipaddresses.csv from the
+    # store, the subnet runs are compacted into one on the way
+    run = compact_runs(os.path.join(spool, 'subnets'))
+
+    fsub = open('subnets.csv', "w")
+    fsub.write('subnetID:ID\n')
+    frel = open('relationships.csv', "w")
+    frel.write(':START_ID,:END_ID,:TYPE\n')
+    if run is not None:
+        merge_runs([run], fsub, lambda line: write_relationships(frel, line.rstrip('\n')))
+    fsub.close()
+    frel.close()
+
+    f, bits = open_bitmap(spool)
+    fip = open('ipaddresses.csv', "w")
+    fip.write('ip_addr:ID,ip_num\n')
+    write_ipaddresses(fip, bits)
+    fip.close()
+    bits.close()
+    f.close()
+
 
 def main():
-    
-    ip_spool_dirs = ["./ipaddresses", "./subnets", "./relationships"]
-    for d in ip_spool_dirs:
+
+    for d in [spool_dir, os.path.join(spool_dir, 'subnets')]:
         if not os.path.exists(d):
             os.makedirs(d)
 
-    pool = Pool(processes=cpu_count()-1) or 1
-    print pool
-    
+    processes = max(cpu_count() - 1, 1)
+    pool = Pool(processes=processes)
+    print("generating subnets into %s on %d processes" % (spool_dir, processes))
+
     loops = total_loops
     while loops > 0:
-        pool.apply_async(generate_subnets, args=(loops, None))
+        pool.apply_async(generate_subnets, args=(loops, spool_dir))
         loops -= step
-    
+
     pool.close()
     pool.join()
-    
-    #merge files, keep uniq lines
-    print "merging files for uniq lines...",
-    for master in ['ipaddresses', 'subnets', 'relationships']:
-        print "\t" + master + "...",
-        loops = total_loops
-        f = open(master + '.csv', "a")
-        lines_seen = set()
-        while loops > 0:
-            filename = master + '-' + str(loops) + ".csv"
-            try:
-                for line in open(filename, "r"):
-                    if line not in lines_seen:
-                        f.write(line)
-                        lines_seen.add(line) 
-                os.unlink(filename)
-            except:
-                pass
-            loops -= step
-        f.close()
-    print "done"
+
+    #merge the store, keep uniq lines
+    print("merging spool into csv files...", end=' ')
+    merge_store(spool_dir)
+    print("done")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,21 @@
+"""
+subnet_cidr.py holds the a.b.c.d/mask parsing shared by 08_subnet_index.py
+and 09_subnet_overlaps.py, so both read subnet ids into the same ranges.
+"""
+
+
+def ip2int(ip):
+    a, b, c, d = [int(octet) for octet in ip.split('.')]
+    return a << 24 | b << 16 | c << 8 | d
+
+
+def int2ip(i):
+    return "%s.%s.%s.%s" % (i >> 24, (i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+
+def cidr_range(cidr):
+    # [network, broadcast] of a.b.c.d/mask, any host address of the subnet
+    ip, mask = cidr.split('/')
+    host_bits = (1 << (32 - int(mask))) - 1
+    ip_int = ip2int(ip)
+    return ip_int & ~host_bits & 0xffffffff, ip_int | host_bits
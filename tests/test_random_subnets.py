@@ -0,0 +1,25 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      '06_random_subnets_with_nodes_parallel.py')
+
+
+def test_compressed_stats_count_output_bytes(tmp_path):
+    subprocess.check_call([sys.executable, SCRIPT, '--engine', 'python',
+                           '--total-loops', '20', '--step', '10', '--seed', '1',
+                           '--compress', 'gzip', '--stats', 'stats.json'],
+                          cwd=str(tmp_path), stdout=subprocess.DEVNULL)
+
+    with open(str(tmp_path / 'stats.json')) as f:
+        report = json.load(f)
+    assert report['totals']['shard_bytes'] > 0
+    assert report['totals']['bytes'] == sum(
+        os.path.getsize(str(tmp_path / (master + '.csv.gz')))
+        for master in ('subnets', 'relationships', 'ipaddresses'))
+    assert report['totals']['bytes'] > 0
+    with gzip.open(str(tmp_path / 'subnets.csv.gz'), 'rt') as f:
+        assert len(f.readlines()) > 1